@@ -3,7 +3,9 @@ from .models import *
 
 
 admin.site.register(ThumbnailSize)
+admin.site.register(EncodingProfile)
 admin.site.register(AccountTierClass)
 admin.site.register(AccountTier)
 admin.site.register(Image)
 admin.site.register(Thumbnail)
+admin.site.register(ThumbnailJob)
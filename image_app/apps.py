@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ImageAppConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'image_app'
+
+    def ready(self):
+        from . import signals
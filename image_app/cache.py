@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from collections import OrderedDict
+from functools import partial
+from threading import Lock
+import hashlib
+import time
+from .responses import accepted_formats
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ListingCache:
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _incr(self, key, initial=1):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, initial, None)
+            return self.cache.get(key)
+
+    def version(self, user_id):
+        key = 'version:%s' % user_id
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    def invalidate(self, user_id):
+        self._incr('version:%s' % user_id, time.time_ns())
+
+    def invalidate_on_commit(self, user_id):
+        transaction.on_commit(partial(self.invalidate, user_id))
+
+    def key(self, request):
+        url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+        formats = ','.join(sorted(set(accepted_formats(request)) & set(settings.THUMBNAIL_RENDITION_FORMATS)))
+        return 'listing:%s:%s:%s:%s' % (request.user.pk, self.version(request.user.pk), url, formats)
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self._incr('hits' if data is not None else 'misses')
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data)
+
+    def stats(self):
+        return {'hits': self.cache.get('hits', 0), 'misses': self.cache.get('misses', 0)}
+
+
+listing_cache = ListingCache('listings')
@@ -1,25 +1,381 @@
+from django.conf import settings
 from django.core.files import File
-from PIL import Image
+from PIL import Image, features
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
 from math import ceil
+import hashlib
 import io
+import mmap
+import secrets
+import struct
+import time
 from . import models
+from .uploadhandlers import staged_file
 
 
-def resize_thumbnail(file, height):
-    image = Image.open(file)
+DECODE_STRATEGIES = ('full', 'draft')
+IMAGE_FORMATS = {'JPEG': ('image/jpeg', '.jpg'), 'PNG': ('image/png', '.png')}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SOF_MARKERS = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+SNIFF_TAIL = 1024
+DECODE_ERRORS = (OSError, SyntaxError, ValueError)
+RESAMPLING_FILTERS = ('nearest', 'box', 'bilinear', 'hamming', 'bicubic', 'lanczos')
+ID_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+ID_LENGTH = 18
+
+
+def generate_unique_id():
+    value = (time.time_ns() // 1000000) << 40 | secrets.randbits(40)
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, index = divmod(value, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def content_hash(file):
+    if getattr(file, 'content_hash', None):
+        return file.content_hash
+    digest = hashlib.blake2b(digest_size=32)
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _mapped(file):
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        yield file
+        return
+    with buffer:
+        yield buffer
+
+
+def _open_header(file):
+    try:
+        return Image.open(file)
+    except Image.DecompressionBombError:
+        raise ImageTooLarge
+
+
+def _png_size(source):
+    length, chunk_type, width, height = struct.unpack('>I4sII', source.read(16))
+    if chunk_type != b'IHDR' or length != 13:
+        raise InvalidImage
+    return width, height
+
+
+def _jpeg_size(source):
+    source.seek(2)
+    while True:
+        marker = source.read(2)
+        while len(marker) == 2 and marker == b'\xff\xff':
+            marker = marker[1:] + source.read(1)
+        if len(marker) < 2 or marker[0] != 0xff or marker[1] in (0xd9, 0xda):
+            raise InvalidImage
+        if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd8:
+            continue
+        length, = struct.unpack('>H', source.read(2))
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', source.read(5))
+            return width, height
+        if length < 2:
+            raise InvalidImage
+        source.seek(length - 2, io.SEEK_CUR)
+
+
+def sniff_image(file):
+    with _mapped(file) as source:
+        try:
+            source.seek(0, io.SEEK_END)
+            size = source.tell()
+            source.seek(0)
+            signature = source.read(len(PNG_SIGNATURE))
+            if signature == PNG_SIGNATURE:
+                format, (width, height) = 'PNG', _png_size(source)
+                source.seek(max(size - SNIFF_TAIL, 0))
+                if b'IEND' not in source.read():
+                    raise InvalidImage
+            elif signature[:3] == b'\xff\xd8\xff':
+                format, (width, height) = 'JPEG', _jpeg_size(source)
+            else:
+                raise InvalidImage
+        except (struct.error, ValueError) as error:
+            raise InvalidImage from error
+    if not width or not height:
+        raise InvalidImage
+    return format, (width, height)
+
+
+def inspect_image(file):
+    with _mapped(file) as source:
+        image = _open_header(source)
+        return image.format, image.size, image.mode
+
+
+def fits_decode_budget(format, width, height):
+    budget = settings.THUMBNAIL_MAX_DECODE_PIXELS
+    if format == 'JPEG':
+        return ceil(width / 8) * ceil(height / 8) <= budget
+    return width * height <= budget
+
+
+def _budget_draft_size(image, budget):
+    scale = 1
+    while scale < 8 and ceil(image.width / scale) * ceil(image.height / scale) > budget:
+        scale *= 2
+    return ceil(image.width / scale), ceil(image.height / scale)
+
+
+def open_image(file, height=None, strategy=None):
+    if strategy is None:
+        strategy = settings.THUMBNAIL_DECODE_STRATEGY
+    if strategy not in DECODE_STRATEGIES:
+        raise ValueError
+    with _mapped(file) as source:
+        image = _open_header(source)
+        budget = settings.THUMBNAIL_MAX_DECODE_PIXELS
+        draft_size = None
+        if strategy == 'draft' and height is not None and height < image.height:
+            draft_size = (ceil(image.width * height / image.height), height)
+        if image.width * image.height > budget:
+            budget_size = _budget_draft_size(image, budget)
+            draft_size = budget_size if draft_size is None else tuple(map(min, draft_size, budget_size))
+        if draft_size is not None and image.format == 'JPEG':
+            image.draft(image.mode, draft_size)
+        if image.width * image.height > budget:
+            raise ImageTooLarge
+        try:
+            image.load()
+        except (OSError, SyntaxError) as error:
+            raise InvalidImage from error
+        return image
+
+
+def resize_image(image, height, resample=None, reducing_gap=None):
+    if resample is None:
+        resample = settings.THUMBNAIL_RESAMPLING
+        reducing_gap = settings.THUMBNAIL_REDUCING_GAP
+    if resample not in RESAMPLING_FILTERS:
+        raise ValueError
     ratio = image.height / height
-    image = image.resize((ceil(image.width / ratio), height))
-    return image
+    size = (ceil(image.width / ratio), height)
+    return image.resize(size, getattr(Image, resample.upper()), reducing_gap=reducing_gap)
+
+
+def resize_thumbnail(file, height, strategy=None):
+    return resize_image(open_image(file, height, strategy), height)
+
+
+def build_pyramid(file, heights, strategy=None):
+    source = open_image(file, max(heights, default=None), strategy)
+    pyramid = {}
+    for height in sorted(set(heights), reverse=True):
+        pyramid[height] = resize_image(source, height)
+        if height <= source.height:
+            source = pyramid[height]
+    return pyramid
+
+
+def photo_format(photo):
+    if photo.name[-3:] == 'jpg':
+        return 'jpeg'
+    return 'png'
+
+
+def save_options(profile, format):
+    if profile is None:
+        return {}
+    return profile.save_options(format)
+
+
+def encoding_fingerprint(profile):
+    if profile is None:
+        return ''
+    return profile.fingerprint()
+
+
+def encode_image(image, format, options=None):
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format=format, **(options or {}))
+    return img_bytes.getvalue()
+
+
+def rendition_formats():
+    return [format for format in settings.THUMBNAIL_RENDITION_FORMATS
+            if format in models.Thumbnail.RENDITION_FORMATS and features.check(format)]
 
 
-def save_photo(file, photo):
+def rendition_name(name, format):
+    return name[:name.rfind('.')] + '.' + format
+
+
+def encode_photo(image, photo, format=None, profile=None):
     if not isinstance(photo, models.Thumbnail):
         raise TypeError
-    image = resize_thumbnail(file, photo.thumbnail_size.height)
-    img_bytes = io.BytesIO()
-    if photo.name[-3:] == 'jpg':
-        image.save(img_bytes, format='jpeg')
-    else:
-        image.save(img_bytes, format='png')
-    file = File(img_bytes, name=photo.name)
+    name = photo.name if format is None else rendition_name(photo.name, format)
+    format = format or photo_format(photo)
+    file = staged_file(name, 'image/' + format)
+    image.save(file, format=format, **save_options(profile, format))
+    file.seek(0)
     return file
+
+
+def encode_renditions(image, photo, profile=None):
+    return encode_photo(image, photo, profile=profile), {
+        format: encode_photo(image, photo, format, profile) for format in rendition_formats()}
+
+
+def save_photo(file, photo, profile=None):
+    if not isinstance(photo, models.Thumbnail):
+        raise TypeError
+    image = resize_thumbnail(file, photo.thumbnail_size.height)
+    return encode_photo(image, photo, profile=profile)
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_POOL_SIZE)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+def resize_buffer(mode, size, buffer_name, height, formats, options):
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    try:
+        pixels = bytes(buffer.buf)
+    finally:
+        buffer.close()
+    image = resize_image(Image.frombytes(mode, size, pixels), height)
+    return [encode_image(image, format, format_options) for format, format_options in zip(formats, options)]
+
+
+def _submit_parallel(file, photos, profile):
+    source = open_image(file, max(photo.thumbnail_size.height for photo in photos))
+    if source.mode == 'P':
+        source = source.convert('RGBA')
+    pixels = source.tobytes()
+    buffer = shared_memory.SharedMemory(create=True, size=max(len(pixels), 1))
+    try:
+        buffer.buf[:len(pixels)] = pixels
+        del pixels
+        futures = []
+        for photo in photos:
+            photo_formats = [photo_format(photo)] + rendition_formats()
+            futures.append(get_pool().submit(resize_buffer, source.mode, source.size, buffer.name,
+                                             photo.thumbnail_size.height, photo_formats,
+                                             [save_options(profile, format) for format in photo_formats]))
+    except BaseException:
+        _release(buffer)
+        raise
+    return futures, buffer
+
+
+def _release(buffer):
+    buffer.close()
+    buffer.unlink()
+
+
+def _collect_parallel(submitted, photos):
+    futures, buffer = submitted
+    formats = rendition_formats()
+    rendered = []
+    try:
+        for future, photo in zip(futures, photos):
+            content, *renditions = future.result()
+            rendered.append((File(io.BytesIO(content), name=photo.name),
+                             {format: File(io.BytesIO(rendition), name=rendition_name(photo.name, format))
+                              for format, rendition in zip(formats, renditions)}))
+    finally:
+        _release(buffer)
+    return rendered
+
+
+def render_parallel(file, photos, profile=None):
+    return _collect_parallel(_submit_parallel(file, photos, profile), photos)
+
+
+def _render_or_error(render, return_exceptions):
+    try:
+        return render()
+    except DECODE_ERRORS as error:
+        if not return_exceptions:
+            raise
+        return error
+
+
+def _collect_or_error(submitted, photos, return_exceptions):
+    if isinstance(submitted, Exception):
+        return submitted
+    return _render_or_error(partial(_collect_parallel, submitted, photos), return_exceptions)
+
+
+def _submitted_bytes(submitted):
+    return 0 if isinstance(submitted, Exception) else submitted[1].size
+
+
+def _render_batch_parallel(uploads, profile, return_exceptions):
+    budget = settings.THUMBNAIL_MAX_DECODE_PIXELS * 4
+    submitted = deque()
+    in_flight = 0
+    rendered = []
+    for file, photos in uploads:
+        submitted.append((_render_or_error(partial(_submit_parallel, file, photos, profile), return_exceptions),
+                          photos))
+        in_flight += _submitted_bytes(submitted[-1][0])
+        while in_flight > budget and len(submitted) > 1:
+            in_flight -= _submitted_bytes(submitted[0][0])
+            rendered.append(_collect_or_error(*submitted.popleft(), return_exceptions))
+    while submitted:
+        rendered.append(_collect_or_error(*submitted.popleft(), return_exceptions))
+    return rendered
+
+
+def _render_serial(file, photos, profile):
+    pyramid = build_pyramid(file, [photo.thumbnail_size.height for photo in photos])
+    return [encode_renditions(pyramid[photo.thumbnail_size.height], photo, profile) for photo in photos]
+
+
+def render_batch(uploads, profile=None, return_exceptions=False):
+    if [photo for _, photos in uploads for photo in photos if not isinstance(photo, models.Thumbnail)]:
+        raise TypeError
+    if settings.THUMBNAIL_PARALLEL and sum(len(photos) for _, photos in uploads) > 1:
+        try:
+            return _render_batch_parallel(uploads, profile, return_exceptions)
+        except BrokenProcessPool:
+            shutdown_pool()
+    return [_render_or_error(partial(_render_serial, file, photos, profile), return_exceptions)
+            for file, photos in uploads]
+
+
+def render_thumbnails(file, photos, profile=None):
+    return render_batch([(file, photos)], profile)[0]
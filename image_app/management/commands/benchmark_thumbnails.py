@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+from time import perf_counter
+import io
+from ...functions import DECODE_STRATEGIES, RESAMPLING_FILTERS, resize_thumbnail, resize_image, open_image, \
+    encode_image, save_options, rendition_formats
+from ...models import EncodingProfile
+
+
+def create_source(height, format='jpeg'):
+    image = Image.effect_mandelbrot((height * 3 // 2, height), (-2.0, -1.0, 1.0, 1.0), 100).convert('RGB')
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format=format)
+    return img_bytes
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+    return min(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = 'Benchmark thumbnail generation strategies on synthetic sources'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=['decode', 'encode', 'resample'])
+        parser.add_argument('--sources', type=int, nargs='+', default=[1500, 3000, 6000])
+        parser.add_argument('--height', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--filters', nargs='+', choices=RESAMPLING_FILTERS, default=RESAMPLING_FILTERS)
+
+    def handle(self, *args, **options):
+        getattr(self, 'benchmark_' + options['suite'])(options)
+
+    def benchmark_decode(self, options):
+        self.stdout.write('source    ' + ''.join('%12s' % strategy for strategy in DECODE_STRATEGIES) + '   speedup')
+        for source_height in options['sources']:
+            source = create_source(source_height)
+            results = [measure(lambda: resize_thumbnail(source, options['height'], strategy), options['repeat'])
+                       for strategy in DECODE_STRATEGIES]
+            self.stdout.write('%-10s' % (str(source_height) + 'px') + ''.join('%10.2fms' % ms for ms in results) +
+                              '%9.1fx' % (results[0] / results[-1]))
+
+    def benchmark_encode(self, options):
+        profiles = [None] + list(EncodingProfile.objects.order_by('name'))
+        self.stdout.write('source    profile         format        time       bytes')
+        for source_height in options['sources']:
+            image = resize_thumbnail(create_source(source_height), options['height'])
+            for profile in profiles:
+                for format in ['jpeg', 'png'] + rendition_formats():
+                    format_options = save_options(profile, format)
+                    ms = measure(lambda: encode_image(image, format, format_options), options['repeat'])
+                    self.stdout.write('%-10s%-16s%-8s%10.2fms%12d' % (
+                        str(source_height) + 'px', profile.name if profile else 'default', format, ms,
+                        len(encode_image(image, format, format_options))))
+
+    def benchmark_resample(self, options):
+        gaps = [None, settings.THUMBNAIL_REDUCING_GAP or 3.0]
+        self.stdout.write('source    gap   ' + ''.join('%12s' % name for name in options['filters']))
+        for source_height in options['sources']:
+            image = open_image(create_source(source_height), strategy='full')
+            for gap in gaps:
+                results = [measure(lambda: resize_image(image, options['height'], name, gap), options['repeat'])
+                           for name in options['filters']]
+                self.stdout.write('%-10s%-6s' % (str(source_height) + 'px', gap or '-') +
+                                  ''.join('%10.2fms' % ms for ms in results))
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+import os
+import time
+from ...storage import file_fields, referenced_files, REFERENCE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Remove stored files that no image, thumbnail or job references, and stale upload temp files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Only remove files not modified for this many seconds, protects in-flight uploads')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.stats = {'scanned': 0, 'removed': 0, 'bytes': 0}
+        modified_before = timezone.now() - timezone.timedelta(seconds=options['min_age'])
+        for storage, directory in self.directories():
+            self.sweep(storage, directory, modified_before)
+        self.sweep_temp(time.time() - options['min_age'])
+        self.stdout.write('%s %d of %d files (%d bytes)' % ('Would remove' if self.dry_run else 'Removed',
+                                                           self.stats['removed'], self.stats['scanned'],
+                                                           self.stats['bytes']))
+
+    def directories(self):
+        directories = []
+        for model, field in file_fields():
+            if (field.storage, field.upload_to) not in directories:
+                directories.append((field.storage, field.upload_to))
+        return directories
+
+    def sweep(self, storage, directory, modified_before):
+        if not storage.exists(directory):
+            return
+        names = [os.path.join(directory, name) for name in storage.listdir(directory)[1]]
+        self.stats['scanned'] += len(names)
+        for start in range(0, len(names), REFERENCE_BATCH_SIZE):
+            batch = names[start:start + REFERENCE_BATCH_SIZE]
+            referenced = referenced_files(batch)
+            for name in batch:
+                if name not in referenced and storage.get_modified_time(name) < modified_before:
+                    self.remove(name, storage.size(name), lambda: storage.delete(name))
+
+    def sweep_temp(self, modified_before):
+        if not os.path.isdir(settings.FILE_UPLOAD_TEMP_DIR):
+            return
+        with os.scandir(settings.FILE_UPLOAD_TEMP_DIR) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                self.stats['scanned'] += 1
+                stat = entry.stat()
+                if stat.st_mtime < modified_before:
+                    self.remove(entry.path, stat.st_size, lambda: os.remove(entry.path))
+
+    def remove(self, name, size, delete):
+        self.stats['removed'] += 1
+        self.stats['bytes'] += size
+        if self.dry_run:
+            self.stdout.write('Would remove %s' % name)
+        else:
+            delete()
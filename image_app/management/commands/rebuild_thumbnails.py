@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, IntegrityError
+from contextlib import ExitStack
+import json
+import os
+import time
+from ...functions import render_batch, encoding_fingerprint
+from ...models import Image, Thumbnail, AccountTier
+
+
+class Command(BaseCommand):
+    help = 'Render missing thumbnails for every image whose owner\'s tier includes more sizes than it has'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tier', help='Only images of users in this account tier')
+        parser.add_argument('--user', help='Only images of this username')
+        parser.add_argument('--size', type=int, action='append', help='Only this thumbnail height, repeatable')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, '.rebuild_thumbnails.json'),
+                            help='File storing the last processed image id')
+        parser.add_argument('--resume', action='store_true', help='Continue after the image id in the checkpoint')
+
+    def handle(self, *args, **options):
+        filters = {'tier': options['tier'], 'user': options['user'], 'size': sorted(options['size'] or [])}
+        last_pk = self.read_checkpoint(options['checkpoint'], filters) if options['resume'] else 0
+        images = Image.objects.select_related('owner').order_by('pk')
+        if options['tier']:
+            images = images.filter(owner__accounttier__tier__name=options['tier'])
+        if options['user']:
+            images = images.filter(owner__username=options['user'])
+        self.stats = {'scanned': 0, 'images': 0, 'thumbnails': 0, 'skipped': 0, 'failed': 0}
+        self.started = time.monotonic()
+        while True:
+            batch = list(images.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            self.rebuild_batch(batch, filters['size'])
+            last_pk = batch[-1].pk
+            self.write_checkpoint(options['checkpoint'], filters, last_pk)
+            self.report('Processed up to image %d' % last_pk)
+        if os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        self.report('Done')
+
+    def read_checkpoint(self, path, filters):
+        try:
+            with open(path) as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return 0
+        if checkpoint['filters'] != filters:
+            raise CommandError('Checkpoint %s was written with different filters: %s' % (path, checkpoint['filters']))
+        return checkpoint['last_pk']
+
+    def write_checkpoint(self, path, filters, last_pk):
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'filters': filters, 'last_pk': last_pk}, file)
+        os.replace(path + '.tmp', path)
+
+    def missing_sizes(self, image, existing, heights, abandoned):
+        try:
+            sizes = AccountTier.get_capabilities(image.owner).thumbnail_sizes
+        except AccountTier.DoesNotExist:
+            return []
+        present = {thumbnail.thumbnail_size_id for thumbnail in existing if thumbnail.pk not in abandoned}
+        return [size for size in sizes if size.pk not in present and (not heights or size.height in heights)]
+
+    def source(self, image, thumbnails, height):
+        if image.url:
+            return image.url
+        ready = sorted((thumbnail for thumbnail in thumbnails if thumbnail.status == Thumbnail.Status.READY),
+                       key=lambda thumbnail: thumbnail.thumbnail_size.height)
+        for thumbnail in ready:
+            if thumbnail.thumbnail_size.height >= height:
+                return thumbnail.url
+        return ready[-1].url if ready else None
+
+    def rebuild_batch(self, batch, heights):
+        thumbnails = {}
+        for thumbnail in Thumbnail.objects.filter(image__in=batch).select_related('thumbnail_size'):
+            thumbnails.setdefault(thumbnail.image_id, []).append(thumbnail)
+        abandoned = set(Thumbnail.objects.filter(Thumbnail._abandoned(), image__in=batch).values_list('pk', flat=True))
+        renders = {}
+        with ExitStack() as stack:
+            for image in batch:
+                self.stats['scanned'] += 1
+                existing = thumbnails.get(image.pk, [])
+                sizes = self.missing_sizes(image, existing, heights, abandoned)
+                if not sizes:
+                    continue
+                source = self.source(image, existing, max(size.height for size in sizes))
+                if source is None:
+                    self.stats['skipped'] += 1
+                    continue
+                rows = {thumbnail.thumbnail_size_id: thumbnail for thumbnail in existing}
+                photos = [rows.get(size.pk) or Thumbnail(name=Thumbnail._generate_name(image, size), image=image,
+                                                         thumbnail_size=size) for size in sizes]
+                reused = Thumbnail._reuse_duplicate_files(image, photos)
+                photos = [photo for photo in photos if photo not in reused]
+                self.stats['thumbnails'] += len(reused)
+                if not photos:
+                    self.stats['images'] += 1
+                    continue
+                try:
+                    file = stack.enter_context(source.open('rb'))
+                except OSError as error:
+                    self.store(photos, error, None)
+                    continue
+                profile = AccountTier.get_encoding_profile(image.owner)
+                renders.setdefault(encoding_fingerprint(profile), (profile, []))[1].append((file, photos))
+            for profile, uploads in renders.values():
+                for (_, photos), rendered in zip(uploads, render_batch(uploads, profile, return_exceptions=True)):
+                    self.store(photos, rendered, profile)
+
+    def store(self, photos, rendered, profile):
+        if isinstance(rendered, Exception):
+            self.stats['failed'] += 1
+            self.stderr.write('Failed to render %s: %r' % (photos[0].image.name, rendered))
+            return
+        for photo, (file, renditions) in zip(photos, rendered):
+            try:
+                with transaction.atomic():
+                    photo._upload_thumbnail(file, renditions, profile)
+                self.stats['thumbnails'] += 1
+            except IntegrityError as error:
+                self.stats['failed'] += 1
+                self.stderr.write('Failed to store %s: %r' % (photo.name, error))
+        self.stats['images'] += 1
+
+    def report(self, message):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write('%s: scanned %d images, rebuilt %d images (%d thumbnails), %d skipped, %d failed, '
+                          '%.1f images/s' % (message, self.stats['scanned'], self.stats['images'],
+                                             self.stats['thumbnails'], self.stats['skipped'], self.stats['failed'],
+                                             self.stats['images'] / elapsed if elapsed else 0))
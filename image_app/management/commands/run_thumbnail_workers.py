@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from multiprocessing import Process
+import os
+import socket
+import time
+from ...models import ThumbnailJob
+
+
+def work(worker, poll_interval, burst):
+    processed = 0
+    while True:
+        job = ThumbnailJob.claim(worker)
+        if job is None:
+            if burst:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        job.run()
+        processed += 1
+
+
+def run_worker(index, poll_interval, burst):
+    work('%s:%s:%s' % (socket.gethostname(), os.getpid(), index), poll_interval, burst)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes that render queued thumbnail jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS,
+                            help='Number of worker processes, 0 runs a single worker in this process')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = ThumbnailJob.requeue_stale(settings.THUMBNAIL_JOB_TIMEOUT)
+        if requeued:
+            self.stdout.write('Requeued %d stale jobs' % requeued)
+        if options['workers'] == 0:
+            processed = work('%s:%s' % (socket.gethostname(), os.getpid()), options['poll_interval'],
+                             options['burst'])
+            self.stdout.write('Processed %d jobs' % processed)
+            return
+        connections.close_all()
+        processes = [Process(target=run_worker, args=(index, options['poll_interval'], options['burst']))
+                     for index in range(options['workers'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -1,9 +1,17 @@
-from django.db import models
-from django.core.validators import MinValueValidator
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.core import signing
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import User
 from django.utils import timezone
-from .functions import save_photo
+from .functions import render_thumbnails, render_batch, generate_unique_id, content_hash, rendition_name, \
+    inspect_image, encoding_fingerprint, DECODE_ERRORS
+from .cache import LRUCache, listing_cache
 from django.core.files import File
+from threading import Lock
+from weakref import WeakValueDictionary
+import hashlib
+import time
 
 
 class ThumbnailSize(models.Model):
@@ -21,11 +29,43 @@ class ThumbnailSize(models.Model):
         return cls.objects.get_or_create(height=height)[0]
 
 
+class EncodingProfile(models.Model):
+    class Subsampling(models.IntegerChoices):
+        YUV444 = 0, '4:4:4'
+        YUV422 = 1, '4:2:2'
+        YUV420 = 2, '4:2:0'
+
+    name = models.CharField(max_length=50, unique=True)
+    quality = models.IntegerField(default=75, validators=[MinValueValidator(1), MaxValueValidator(95)])
+    progressive = models.BooleanField(default=False)
+    optimize = models.BooleanField(default=False)
+    subsampling = models.IntegerField(choices=Subsampling.choices, default=Subsampling.YUV420)
+    compress_level = models.IntegerField(default=6, validators=[MinValueValidator(0), MaxValueValidator(9)])
+
+    def __str__(self):
+        return self.name
+
+    def save_options(self, format):
+        if format == 'jpeg':
+            return {'quality': self.quality, 'progressive': self.progressive, 'optimize': self.optimize,
+                    'subsampling': self.subsampling}
+        if format == 'png':
+            return {'optimize': self.optimize, 'compress_level': self.compress_level}
+        return {'quality': self.quality}
+
+    def fingerprint(self):
+        options = '%d:%d:%d:%d:%d' % (self.quality, self.progressive, self.optimize, self.subsampling,
+                                      self.compress_level)
+        return hashlib.blake2b(options.encode(), digest_size=8).hexdigest()
+
+
 class AccountTierClass(models.Model):
     name = models.CharField(max_length=50, unique=True)
     original_image = models.BooleanField(default=False)
     expiring_link = models.BooleanField(default=False)
     thumbnail_sizes = models.ManyToManyField(ThumbnailSize)
+    max_pixels = models.IntegerField(default=50000000, validators=[MinValueValidator(1)])
+    encoding_profile = models.ForeignKey(EncodingProfile, on_delete=models.SET_NULL, null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -56,13 +96,42 @@ class AccountTierClass(models.Model):
         return False
 
 
+class TierCapabilities:
+    def __init__(self, tier):
+        self.tier_id = tier.pk
+        self.name = tier.name
+        self.original_image = tier.original_image
+        self.expiring_link = tier.expiring_link
+        self.max_pixels = tier.max_pixels
+        self.encoding_profile = tier.encoding_profile
+        self.thumbnail_sizes = tuple(tier.thumbnail_sizes.order_by('-height'))
+        self.heights = tuple(size.height for size in self.thumbnail_sizes)
+
+
 class AccountTier(models.Model):
     tier = models.ForeignKey(AccountTierClass, on_delete=models.CASCADE)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
 
+    capabilities_cache = LRUCache(settings.TIER_CACHE_SIZE, settings.TIER_CACHE_TTL)
+
     def __str__(self):
         return str(self.tier) + ': ' + self.user.username
 
+    @classmethod
+    def get_capabilities(cls, user):
+        capabilities = cls.capabilities_cache.get(user.pk)
+        if capabilities is None:
+            capabilities = TierCapabilities(cls.objects.select_related('tier__encoding_profile').get(user=user).tier)
+            cls.capabilities_cache.set(user.pk, capabilities)
+        return capabilities
+
+    @classmethod
+    def get_encoding_profile(cls, user):
+        try:
+            return cls.get_capabilities(user).encoding_profile
+        except cls.DoesNotExist:
+            return None
+
     @classmethod
     def add_user_to_account_tier(cls, tier, user):
         if not isinstance(tier, AccountTierClass) or not isinstance(user, User):
@@ -87,6 +156,7 @@ class Image(models.Model):
     name = models.CharField(max_length=50, unique=True)
     url = models.ImageField(upload_to='images/', blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -95,21 +165,65 @@ class Image(models.Model):
     def _generate_name(cls, extension, owner):
         if extension not in ['.jpg', '.png']:
             raise ValueError
-        name = str(owner.pk) + str(int(timezone.now().timestamp())) + str(cls.objects.filter(owner=owner).count())
-        return name + extension
+        return str(owner.pk) + generate_unique_id() + extension
 
     @classmethod
     def create_image(cls, owner, file):
         if not isinstance(owner, User) or not isinstance(file, File):
             raise TypeError
-        account_tier = AccountTier.objects.get(user=owner).tier
+        account_tier = AccountTier.get_capabilities(owner)
         name = cls._generate_name(file.name[-4:], owner)
-        image = cls(name=name, owner=owner)
-        image.save()
+        image = cls(name=name, owner=owner, content_hash=content_hash(file))
         if account_tier.original_image:
+            image.url = cls._stored_original(owner, image.content_hash) or ''
+        image.save()
+        if account_tier.original_image and not image.url:
             image._upload_image(file)
         return image
 
+    @classmethod
+    def create_images(cls, owner, files):
+        if not isinstance(owner, User) or [file for file in files if not isinstance(file, File)]:
+            raise TypeError
+        account_tier = AccountTier.get_capabilities(owner)
+        images = [cls(name=cls._generate_name(file.name[-4:], owner), owner=owner, content_hash=content_hash(file))
+                  for file in files]
+        written = []
+        try:
+            if account_tier.original_image:
+                stored = cls._stored_originals(owner, {image.content_hash for image in images})
+                for image, file in zip(images, files):
+                    if image.content_hash not in stored:
+                        image.url.save(image.name, file, save=False)
+                        written.append(image.url)
+                        stored[image.content_hash] = image.url.name
+                    image.url = stored[image.content_hash]
+            cls.objects.bulk_create(images)
+        except BaseException:
+            for field_file in written:
+                field_file.delete(save=False)
+            raise
+        created = {image.name: image for image in cls.objects.filter(name__in=[image.name for image in images])}
+        images = [created[image.name] for image in images]
+        for image in images:
+            models.signals.post_save.send(sender=cls, instance=image, created=True, update_fields=None, raw=False,
+                                          using=image._state.db)
+        return images
+
+    @classmethod
+    def _stored_original(cls, owner, content_hash):
+        return cls._stored_originals(owner, [content_hash]).get(content_hash)
+
+    @classmethod
+    def _stored_originals(cls, owner, content_hashes):
+        storage = cls._meta.get_field('url').storage
+        stored = {}
+        for content_hash, url in cls.objects.filter(owner=owner, content_hash__in=content_hashes).exclude(url='') \
+                .values_list('content_hash', 'url'):
+            if content_hash not in stored and storage.exists(url):
+                stored[content_hash] = url
+        return stored
+
     def _upload_image(self, file):
         file.name = self.name
         self.url = file
@@ -117,10 +231,25 @@ class Image(models.Model):
 
 
 class Thumbnail(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        READY = 'ready'
+        FAILED = 'failed'
+
+    RENDITION_FORMATS = ('avif', 'webp')
+
     name = models.CharField(max_length=60, unique=True)
     url = models.ImageField(upload_to='thumbnails/', null=True)
+    avif = models.ImageField(upload_to='thumbnails/', blank=True)
+    webp = models.ImageField(upload_to='thumbnails/', blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    encoding = models.CharField(max_length=16, blank=True)
+    width = models.IntegerField(null=True)
+    rendered_at = models.DateTimeField(null=True)
+    claimed_at = models.DateTimeField(null=True)
     image = models.ForeignKey(Image, on_delete=models.CASCADE)
     thumbnail_size = models.ForeignKey(ThumbnailSize, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.READY)
 
     def __str__(self):
         return self.name
@@ -136,40 +265,415 @@ class Thumbnail(models.Model):
     def create_thumbnail(cls, image, thumbnail_size, file):
         if not isinstance(image, Image) or not isinstance(thumbnail_size, ThumbnailSize) or not isinstance(file, File):
             raise TypeError
-        if thumbnail_size not in AccountTier.objects.get(user=image.owner).tier.thumbnail_sizes.all() or \
-                Thumbnail.objects.filter(image=image, thumbnail_size=thumbnail_size).count():
+        if thumbnail_size not in AccountTier.get_capabilities(image.owner).thumbnail_sizes or \
+                Thumbnail.objects.filter(image=image, thumbnail_size=thumbnail_size).exists():
             raise ValueError
         name = cls._generate_name(image, thumbnail_size)
         thumbnail = cls(name=name, image=image, thumbnail_size=thumbnail_size)
         thumbnail.save()
-        file = save_photo(file, thumbnail)
-        thumbnail._upload_thumbnail(file)
+        profile = AccountTier.get_encoding_profile(image.owner)
+        file, renditions = render_thumbnails(file, [thumbnail], profile)[0]
+        thumbnail._upload_thumbnail(file, renditions, profile)
         return file, thumbnail
 
-    def _upload_thumbnail(self, file):
+    @classmethod
+    def _validate_thumbnail_sizes(cls, image, thumbnail_sizes, file):
+        if not isinstance(image, Image) or not isinstance(file, File) or \
+                [size for size in thumbnail_sizes if not isinstance(size, ThumbnailSize)]:
+            raise TypeError
+        tier_sizes = AccountTier.get_capabilities(image.owner).thumbnail_sizes
+        if [size for size in thumbnail_sizes if size not in tier_sizes] or \
+                Thumbnail.objects.filter(image=image, thumbnail_size__in=thumbnail_sizes).exists():
+            raise ValueError
+
+    @classmethod
+    def _create_pending(cls, image, thumbnail_sizes, save=True):
+        thumbnails = []
+        for thumbnail_size in sorted(thumbnail_sizes, key=lambda size: size.height, reverse=True):
+            name = cls._generate_name(image, thumbnail_size)
+            thumbnail = cls(name=name, image=image, thumbnail_size=thumbnail_size, status=cls.Status.PENDING,
+                            claimed_at=timezone.now())
+            if save:
+                thumbnail.save()
+            thumbnails.append(thumbnail)
+        return thumbnails
+
+    @classmethod
+    def _duplicates(cls, image, thumbnail_sizes):
+        if not image.content_hash:
+            return {}
+        storage = cls._meta.get_field('url').storage
+        duplicates = {}
+        encoding = encoding_fingerprint(AccountTier.get_encoding_profile(image.owner))
+        thumbnails = cls.objects.filter(image__owner_id=image.owner_id, image__content_hash=image.content_hash,
+                                        status=cls.Status.READY, encoding=encoding,
+                                        thumbnail_size__in=thumbnail_sizes).exclude(image=image)
+        for thumbnail in thumbnails.only('thumbnail_size', 'url', 'content_hash', 'encoding', 'width', 'rendered_at',
+                                         *cls.RENDITION_FORMATS):
+            if thumbnail.thumbnail_size_id not in duplicates and storage.exists(thumbnail.url.name):
+                duplicates[thumbnail.thumbnail_size_id] = thumbnail
+        return duplicates
+
+    def _reuse_files(self, duplicate):
+        self.url = duplicate.url.name
+        for format in self.RENDITION_FORMATS:
+            setattr(self, format, getattr(duplicate, format).name)
+        self.content_hash = duplicate.content_hash
+        self.encoding = duplicate.encoding
+        self.width = duplicate.width
+        self.rendered_at = duplicate.rendered_at
+        self.status = self.Status.READY
+        self.save()
+
+    @classmethod
+    def _reuse_duplicates(cls, image, thumbnail_sizes):
+        duplicates = cls._duplicates(image, thumbnail_sizes)
+        return cls._reuse_duplicate_files(image, cls._create_pending(
+            image, [size for size in thumbnail_sizes if size.pk in duplicates], save=False), duplicates)
+
+    @classmethod
+    def _reuse_duplicate_files(cls, image, thumbnails, duplicates=None):
+        if duplicates is None:
+            duplicates = cls._duplicates(image, [thumbnail.thumbnail_size for thumbnail in thumbnails])
+        reused = [thumbnail for thumbnail in thumbnails if thumbnail.thumbnail_size_id in duplicates]
+        for thumbnail in reused:
+            thumbnail._reuse_files(duplicates[thumbnail.thumbnail_size_id])
+        return reused
+
+    @classmethod
+    def _prepare_thumbnails(cls, image, thumbnail_sizes, file):
+        cls._validate_thumbnail_sizes(image, thumbnail_sizes, file)
+        reused = cls._reuse_duplicates(image, thumbnail_sizes)
+        reused_sizes = [thumbnail.thumbnail_size for thumbnail in reused]
+        thumbnails = cls._create_pending(image, [size for size in thumbnail_sizes if size not in reused_sizes],
+                                         save=False)
+        return reused, thumbnails
+
+    @classmethod
+    def create_thumbnails(cls, image, thumbnail_sizes, file):
+        reused, thumbnails = cls._prepare_thumbnails(image, thumbnail_sizes, file)
+        if thumbnails:
+            profile = AccountTier.get_encoding_profile(image.owner)
+            for thumbnail, (rendered, renditions) in zip(thumbnails, render_thumbnails(file, thumbnails, profile)):
+                thumbnail._upload_thumbnail(rendered, renditions, profile)
+        return sorted(reused + thumbnails, key=lambda thumbnail: thumbnail.thumbnail_size.height, reverse=True)
+
+    @classmethod
+    def create_thumbnails_batch(cls, uploads, thumbnail_sizes, return_exceptions=False):
+        if len({image.owner_id for image, _ in uploads}) > 1:
+            raise ValueError
+        created, renders, repeated, rendered_hashes = {}, [], [], set()
+        for image, file in uploads:
+            if image.content_hash and image.content_hash in rendered_hashes:
+                repeated.append((image, file))
+                continue
+            reused, thumbnails = cls._prepare_thumbnails(image, thumbnail_sizes, file)
+            created[image.pk] = reused + thumbnails
+            if thumbnails:
+                rendered_hashes.add(image.content_hash)
+                renders.append((image, file, thumbnails))
+        if renders:
+            profile = AccountTier.get_encoding_profile(uploads[0][0].owner)
+            rendered_batch = render_batch([(file, thumbnails) for _, file, thumbnails in renders], profile,
+                                          return_exceptions)
+            for (image, _, thumbnails), rendered in zip(renders, rendered_batch):
+                if isinstance(rendered, Exception):
+                    created[image.pk] = rendered
+                    continue
+                for thumbnail, (file, renditions) in zip(thumbnails, rendered):
+                    thumbnail._upload_thumbnail(file, renditions, profile)
+        for image, file in repeated:
+            try:
+                created[image.pk] = cls.create_thumbnails(image, thumbnail_sizes, file)
+            except DECODE_ERRORS as error:
+                if not return_exceptions:
+                    raise
+                created[image.pk] = error
+        return [created[image.pk] if isinstance(created[image.pk], Exception) else
+                sorted(created[image.pk], key=lambda thumbnail: thumbnail.thumbnail_size.height, reverse=True)
+                for image, _ in uploads]
+
+    def _upload_thumbnail(self, file, renditions=None, profile=None):
+        renditions = renditions or {}
+        self.content_hash = content_hash(file)
+        self.encoding = encoding_fingerprint(profile)
+        self.width = inspect_image(file)[1][0]
+        self.rendered_at = timezone.now()
         file.name = self.name
         self.url = file
-        self.save()
+        for format, rendition in renditions.items():
+            rendition.name = rendition_name(self.name, format)
+            setattr(self, format, rendition)
+        self.status = self.Status.READY
+        try:
+            self.save()
+        except BaseException:
+            for field_file in [self.url, *(getattr(self, format) for format in renditions)]:
+                if field_file._committed:
+                    field_file.delete(save=False)
+            raise
+        finally:
+            for rendered in [file, *renditions.values()]:
+                rendered.close()
+
+    def rendition(self, formats):
+        for format in self.RENDITION_FORMATS:
+            if format in formats and getattr(self, format):
+                return getattr(self, format), 'image/' + format
+        return self.url, 'image/jpeg' if self.name.endswith('.jpg') else 'image/png'
+
+    def renditions(self):
+        renditions = [self.rendition([])]
+        for format in self.RENDITION_FORMATS:
+            if getattr(self, format):
+                renditions.append((getattr(self, format), 'image/' + format))
+        return renditions
+
+    @property
+    def version(self):
+        return self.content_hash[:16]
+
+    def etag(self, content_type):
+        if not self.content_hash:
+            return None
+        return '"%s.%s"' % (self.content_hash[:32], content_type[len('image/'):])
+
+    _render_locks = WeakValueDictionary()
+    _render_locks_lock = Lock()
+
+    @classmethod
+    def _render_lock(cls, image, thumbnail_size):
+        with cls._render_locks_lock:
+            lock = cls._render_locks.get((image.pk, thumbnail_size.pk))
+            if lock is None:
+                lock = Lock()
+                cls._render_locks[(image.pk, thumbnail_size.pk)] = lock
+            return lock
+
+    @classmethod
+    def _abandoned(cls):
+        claimed_before = timezone.now() - timezone.timedelta(seconds=settings.THUMBNAIL_RENDER_TIMEOUT)
+        return (models.Q(status=cls.Status.FAILED) | models.Q(status=cls.Status.PENDING) & (
+            models.Q(claimed_at__isnull=True) | models.Q(claimed_at__lt=claimed_before))) & \
+            ~models.Q(image__thumbnailjob__status__in=[ThumbnailJob.Status.QUEUED, ThumbnailJob.Status.RUNNING])
+
+    @classmethod
+    def _claim_render(cls, image, thumbnail_size):
+        thumbnail = cls.objects.filter(image=image, thumbnail_size=thumbnail_size).first()
+        now = timezone.now()
+        if thumbnail is None:
+            thumbnail = cls(name=cls._generate_name(image, thumbnail_size), image=image,
+                            thumbnail_size=thumbnail_size, status=cls.Status.PENDING, claimed_at=now)
+            try:
+                with transaction.atomic():
+                    thumbnail.save()
+                return thumbnail, True
+            except IntegrityError:
+                return cls.objects.get(image=image, thumbnail_size=thumbnail_size), False
+        if thumbnail.status != cls.Status.READY and \
+                cls.objects.filter(cls._abandoned(), pk=thumbnail.pk).update(status=cls.Status.PENDING, claimed_at=now):
+            thumbnail.status = cls.Status.PENDING
+            thumbnail.claimed_at = now
+            listing_cache.invalidate_on_commit(image.owner_id)
+            return thumbnail, True
+        return thumbnail, False
+
+    @classmethod
+    def _render_source(cls, image, height):
+        if image.url:
+            return image.url
+        thumbnails = list(cls.objects.filter(image=image, status=cls.Status.READY)
+                          .select_related('thumbnail_size').order_by('thumbnail_size__height'))
+        for thumbnail in thumbnails:
+            if thumbnail.thumbnail_size.height >= height:
+                return thumbnail.url
+        if thumbnails:
+            return thumbnails[-1].url
+        raise FileNotFoundError
+
+    def _render(self):
+        try:
+            duplicate = self._duplicates(self.image, [self.thumbnail_size]).get(self.thumbnail_size_id)
+            if duplicate:
+                self._reuse_files(duplicate)
+                return
+            with self._render_source(self.image, self.thumbnail_size.height).open('rb') as file:
+                profile = AccountTier.get_encoding_profile(self.image.owner)
+                self._upload_thumbnail(*render_thumbnails(file, [self], profile)[0], profile)
+        except Exception:
+            self.status = self.Status.FAILED
+            self.save()
+            raise
+
+    def _wait_until_rendered(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.status == self.Status.PENDING and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.refresh_from_db()
+
+    @classmethod
+    def get_or_render(cls, image, thumbnail_size):
+        if not isinstance(image, Image) or not isinstance(thumbnail_size, ThumbnailSize):
+            raise TypeError
+        if thumbnail_size not in AccountTier.get_capabilities(image.owner).thumbnail_sizes:
+            raise ValueError
+        with cls._render_lock(image, thumbnail_size):
+            thumbnail, claimed = cls._claim_render(image, thumbnail_size)
+            if claimed:
+                thumbnail._render()
+            else:
+                thumbnail._wait_until_rendered(settings.LAZY_THUMBNAIL_TIMEOUT)
+        return thumbnail
 
     @property
     def size(self):
         return str(self.thumbnail_size.height) + 'px'
 
 
+class ThumbnailJob(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        FAILED = 'failed'
+
+    image = models.OneToOneField(Image, on_delete=models.CASCADE)
+    source = models.FileField(upload_to='jobs/')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.image.name
+
+    @classmethod
+    def enqueue(cls, image, thumbnail_sizes, file):
+        Thumbnail._validate_thumbnail_sizes(image, thumbnail_sizes, file)
+        reused_sizes = [thumbnail.thumbnail_size for thumbnail in Thumbnail._reuse_duplicates(image, thumbnail_sizes)]
+        thumbnail_sizes = [size for size in thumbnail_sizes if size not in reused_sizes]
+        if not thumbnail_sizes:
+            return None
+        Thumbnail._create_pending(image, thumbnail_sizes)
+        job = cls(image=image)
+        if image.url:
+            job.source.name = image.url.name
+        else:
+            job.source.save(image.name, file, save=False)
+        job.save()
+        return job
+
+    @classmethod
+    def claim(cls, worker):
+        for pk in cls.objects.filter(status=cls.Status.QUEUED).order_by('pk').values_list('pk', flat=True)[:10]:
+            if cls.objects.filter(pk=pk, status=cls.Status.QUEUED).update(
+                    status=cls.Status.RUNNING, worker=worker, attempts=models.F('attempts') + 1,
+                    started_at=timezone.now()):
+                return cls.objects.get(pk=pk)
+        return None
+
+    @classmethod
+    def requeue_stale(cls, seconds):
+        started_before = timezone.now() - timezone.timedelta(seconds=seconds)
+        return cls.objects.filter(status=cls.Status.RUNNING, started_at__lt=started_before).update(
+            status=cls.Status.QUEUED, worker='')
+
+    def run(self):
+        thumbnails = list(self.image.thumbnail_set.filter(status=Thumbnail.Status.PENDING)
+                          .select_related('thumbnail_size'))
+        try:
+            with self.source.open('rb') as file:
+                profile = AccountTier.get_encoding_profile(self.image.owner)
+                rendered = render_thumbnails(file, thumbnails, profile)
+            for thumbnail, (file, renditions) in zip(thumbnails, rendered):
+                thumbnail._upload_thumbnail(file, renditions, profile)
+        except Exception as error:
+            self.error = repr(error)
+            if self.attempts < settings.THUMBNAIL_JOB_MAX_ATTEMPTS:
+                self.status = self.Status.QUEUED
+            else:
+                self.status = self.Status.FAILED
+                self.image.thumbnail_set.filter(status=Thumbnail.Status.PENDING).update(
+                    status=Thumbnail.Status.FAILED)
+                listing_cache.invalidate_on_commit(self.image.owner_id)
+                self._delete_source()
+            self.save()
+            return False
+        self._delete_source()
+        self.delete()
+        return True
+
+    def _delete_source(self):
+        if self.source.name != self.image.url.name:
+            self.source.storage.delete(self.source.name)
+
+
 class ExpiringLink(models.Model):
+    SIGNING_SALT = 'image_app.ExpiringLink'
+    SIGNING_SEP = '~'
+    MIN_SECONDS = 300
+    MAX_SECONDS = 30000
+
     image = models.ForeignKey(Image, on_delete=models.CASCADE)
     name = models.CharField(max_length=50, unique=True)
     expiring_time = models.DateTimeField()
 
     @classmethod
-    def generate(cls, image, seconds):
+    def _validate(cls, image, seconds):
         if not isinstance(image, Image) or not isinstance(seconds, int) or isinstance(seconds, bool):
             raise TypeError
-        if not 300 <= seconds <= 30000 or image.url.name == '':
+        if not cls.MIN_SECONDS <= seconds <= cls.MAX_SECONDS or image.url.name == '':
             raise ValueError
-        now = timezone.now()
-        name = str(cls.objects.count()) + str(int(now.timestamp())) + image.name
+
+    @classmethod
+    def _signer(cls):
+        return signing.Signer(sep=cls.SIGNING_SEP, salt=cls.SIGNING_SALT)
+
+    @classmethod
+    def _link(cls, image, seconds, now):
+        cls._validate(image, seconds)
+        return cls(image=image, name=generate_unique_id() + image.name,
+                   expiring_time=now + timezone.timedelta(seconds=seconds))
+
+    @classmethod
+    def _signed_link(cls, signer, image, seconds, now):
+        cls._validate(image, seconds)
         expiring_time = now + timezone.timedelta(seconds=seconds)
-        link = cls(image=image, name=name, expiring_time=expiring_time)
+        name = signer.sign_object([image.pk, image.url.name, int(expiring_time.timestamp())])
+        return cls(image=image, name=name, expiring_time=expiring_time)
+
+    @classmethod
+    def generate(cls, image, seconds):
+        link = cls._link(image, seconds, timezone.now())
         link.save()
         return link
+
+    @classmethod
+    def generate_signed(cls, image, seconds):
+        return cls._signed_link(cls._signer(), image, seconds, timezone.now())
+
+    @classmethod
+    def generate_batch(cls, links, signed=False):
+        now = timezone.now()
+        if signed:
+            signer = cls._signer()
+            return [cls._signed_link(signer, image, seconds, now) for image, seconds in links]
+        links = [cls._link(image, seconds, now) for image, seconds in links]
+        cls.objects.bulk_create(links)
+        return links
+
+    @classmethod
+    def is_signed(cls, name):
+        return isinstance(name, str) and cls.SIGNING_SEP in name
+
+    @classmethod
+    def from_signed(cls, name):
+        try:
+            pk, url, expires = cls._signer().unsign_object(name)
+            expiring_time = timezone.datetime.fromtimestamp(expires, tz=timezone.utc)
+        except (signing.BadSignature, ValueError, TypeError):
+            raise cls.DoesNotExist
+        if expiring_time < timezone.now():
+            raise cls.DoesNotExist
+        image = Image(pk=pk, name=url[url.rfind('/') + 1:], url=url)
+        return cls(image=image, name=name, expiring_time=expiring_time)
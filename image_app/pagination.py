@@ -0,0 +1,9 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    page_size = settings.IMAGES_PAGE_SIZE
+    ordering = '-pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.http.response import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework.negotiation import BaseContentNegotiation
+import re
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError
+    return start, end
+
+
+def accepted_formats(request):
+    formats = []
+    for item in request.META.get('HTTP_ACCEPT', '').split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.startswith('image/') and quality > 0:
+            formats.append(media_type[len('image/'):])
+    return formats
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(if_none_match)]
+        return etag is not None and (etag in etags or '*' in etags)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return last_modified is not None and if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def set_validators(response, etag, last_modified, immutable):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        response['Cache-Control'] = 'private, max-age=%d, immutable' % settings.THUMBNAIL_CACHE_MAX_AGE
+    else:
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def read_chunks(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def accel_redirect_response(field_file, content_type):
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_URL + field_file.name
+    return response
+
+
+def file_response(request, field_file, content_type):
+    if settings.MEDIA_ACCEL_REDIRECT_URL:
+        return accel_redirect_response(field_file, content_type)
+    size = field_file.size
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE', ''), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    if byte_range is None:
+        response = FileResponse(field_file.open('rb'), content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_chunks(field_file.open('rb'), start, end - start + 1),
+                                         content_type=content_type, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+class ImageNegotiation(BaseContentNegotiation):
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
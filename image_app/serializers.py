@@ -1,7 +1,9 @@
 from django.forms import PasswordInput
+from django.urls import reverse
 from rest_framework import serializers
 from collections import OrderedDict
 from .models import Image, Thumbnail, ExpiringLink
+from .responses import accepted_formats
 
 
 class UploadSerializer(serializers.Serializer):
@@ -11,6 +13,13 @@ class UploadSerializer(serializers.Serializer):
         fields = ['file_uploaded']
 
 
+class BulkUploadSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.ImageField())
+
+    class Meta:
+        fields = ['files']
+
+
 class ImageSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
     details = serializers.SerializerMethodField()
@@ -44,7 +53,7 @@ class ImageWithThumbnailsSerializer(ImageSerializer):
 
     def get_thumbnails(self, image):
         request = self.context.get('request')
-        thumbnails = Thumbnail.objects.filter(image=image)
+        thumbnails = image.thumbnail_set.all()
         thumbnails_serializer = ThumbnailSerialzer(thumbnails, many=True, context={'request': request})
         return thumbnails_serializer.data
 
@@ -54,20 +63,27 @@ class ThumbnailSerialzer(serializers.ModelSerializer):
 
     class Meta:
         model = Thumbnail
-        fields = ['name', 'size', 'url']
+        fields = ['name', 'size', 'status', 'url']
 
     def get_url(self, thumbnail):
-        url = thumbnail.url.url
+        if not thumbnail.url:
+            return None
         request = self.context.get('request')
-        return request.build_absolute_uri(url)
+        field_file, _ = thumbnail.rendition(accepted_formats(request))
+        return request.build_absolute_uri(field_file.url)
+
+    def to_representation(self, instance):
+        result = super(ThumbnailSerialzer, self).to_representation(instance)
+        return OrderedDict([(key, result[key]) for key in result if result[key] is not None])
 
 
 class LinkGeneratorSerilaizer(serializers.Serializer):
     image_name = serializers.CharField()
     seconds = serializers.IntegerField()
+    signed = serializers.BooleanField(required=False)
 
     class Meta:
-        fields = ['image_name', 'seconds']
+        fields = ['image_name', 'seconds', 'signed']
 
 
 class ExpiringLinkSerializer(serializers.ModelSerializer):
@@ -80,7 +96,7 @@ class ExpiringLinkSerializer(serializers.ModelSerializer):
 
     def get_url(self, expiring_link):
         request = self.context.get('request')
-        return request.build_absolute_uri(expiring_link.name)
+        return request.build_absolute_uri(reverse('expiring-link', args=[expiring_link.name]))
 
 
 class LoginSerializer(serializers.Serializer):
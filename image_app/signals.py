@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import FileField
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from functools import partial
+from .cache import listing_cache
+from .models import ThumbnailSize, AccountTierClass, AccountTier, Image, Thumbnail, ThumbnailJob, EncodingProfile
+from .storage import stage_stored_files, delete_unreferenced
+
+
+@receiver(post_save, sender=AccountTier)
+@receiver(post_delete, sender=AccountTier)
+def invalidate_account_tier(sender, instance, **kwargs):
+    AccountTier.capabilities_cache.delete(instance.user_id)
+
+
+@receiver(post_save, sender=AccountTierClass)
+@receiver(post_delete, sender=AccountTierClass)
+@receiver(post_save, sender=ThumbnailSize)
+@receiver(post_delete, sender=ThumbnailSize)
+@receiver(post_save, sender=EncodingProfile)
+@receiver(post_delete, sender=EncodingProfile)
+@receiver(m2m_changed, sender=AccountTierClass.thumbnail_sizes.through)
+def invalidate_tier_classes(sender, **kwargs):
+    AccountTier.capabilities_cache.clear()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def invalidate_user_listings(sender, instance, **kwargs):
+    listing_cache.invalidate_on_commit(instance.pk if sender is User else instance.owner_id)
+
+
+@receiver(post_save, sender=Thumbnail)
+@receiver(post_delete, sender=Thumbnail)
+def invalidate_thumbnail_listings(sender, instance, **kwargs):
+    try:
+        listing_cache.invalidate_on_commit(instance.image.owner_id)
+    except Image.DoesNotExist:
+        pass
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=Thumbnail)
+@receiver(post_save, sender=ThumbnailJob)
+def stage_saved_files(sender, instance, **kwargs):
+    stage_stored_files(instance)
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=Thumbnail)
+def release_stored_files(sender, instance, **kwargs):
+    for field in sender._meta.get_fields():
+        field_file = getattr(instance, field.name) if isinstance(field, FileField) else None
+        if field_file:
+            transaction.on_commit(partial(delete_unreferenced, field_file.storage, [field_file.name]))
@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import FileField
+from contextlib import contextmanager
+import threading
+from .models import Image, Thumbnail, ThumbnailJob
+
+
+STORED_FILE_MODELS = (Image, Thumbnail, ThumbnailJob)
+REFERENCE_BATCH_SIZE = 500
+
+_staged = threading.local()
+
+
+def file_fields():
+    return [(model, field) for model in STORED_FILE_MODELS
+            for field in model._meta.get_fields() if isinstance(field, FileField)]
+
+
+def referenced_files(names):
+    names = list(names)
+    referenced = set()
+    for start in range(0, len(names), REFERENCE_BATCH_SIZE):
+        batch = names[start:start + REFERENCE_BATCH_SIZE]
+        for model, field in file_fields():
+            referenced.update(model.objects.filter(**{field.name + '__in': batch})
+                              .values_list(field.name, flat=True))
+    return referenced
+
+
+def delete_unreferenced(storage, names):
+    names = set(names)
+    orphans = names - referenced_files(names)
+    for name in orphans:
+        storage.delete(name)
+    return orphans
+
+
+def stage_stored_files(instance):
+    staged = getattr(_staged, 'files', None)
+    if staged is None:
+        return
+    for field in instance._meta.get_fields():
+        field_file = getattr(instance, field.name) if isinstance(field, FileField) else None
+        if field_file:
+            staged.setdefault(field_file.storage, set()).add(field_file.name)
+
+
+@contextmanager
+def atomic_upload():
+    outer = getattr(_staged, 'files', None)
+    _staged.files = staged = {}
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        _staged.files = outer
+        for storage, names in staged.items():
+            delete_unreferenced(storage, names)
+        raise
+    _staged.files = outer
+    if outer is not None:
+        for storage, names in staged.items():
+            outer.setdefault(storage, set()).update(names)
@@ -1,6 +1,6 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
-from ..models import AccountTier, AccountTierClass, ThumbnailSize
+from ..models import AccountTier, AccountTierClass, ThumbnailSize, EncodingProfile
 
 
 class AccountTierTestCase(TestCase):
@@ -100,3 +100,72 @@ class AccountTierTestCase(TestCase):
         self.assertEqual(AccountTier.objects.count(), 1)
         account_tier = AccountTier.objects.get(user=self.user)
         self.assertEqual(account_tier.tier, self.tier_class)
+
+
+class AccountTierCapabilitiesTestCase(TestCase):
+    def setUp(self):
+        self.thumbnails = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200, 400, 800]]
+        self.tier_class = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=self.thumbnails[:2])
+        self.second_tier_class = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=self.thumbnails,
+                                                                          original_image=True)
+        self.user = User(username='User', password='Password')
+        self.user.save()
+        self.account_tier = AccountTier.add_user_to_account_tier(tier=self.tier_class, user=self.user)
+
+    def test_get_capabilities(self):
+        capabilities = AccountTier.get_capabilities(self.user)
+        self.assertEqual(capabilities.tier_id, self.tier_class.pk)
+        self.assertFalse(capabilities.original_image)
+        self.assertFalse(capabilities.expiring_link)
+        self.assertEqual(capabilities.heights, (200, 100))
+        self.assertEqual(list(capabilities.thumbnail_sizes), [self.thumbnails[1], self.thumbnails[0]])
+        with self.assertNumQueries(0):
+            self.assertIs(AccountTier.get_capabilities(self.user), capabilities)
+
+    def test_get_capabilities_without_account_tier(self):
+        user = User(username='User2', password='Password')
+        user.save()
+        self.assertRaises(AccountTier.DoesNotExist, AccountTier.get_capabilities, user)
+
+    def test_get_capabilities_after_change_account_tier(self):
+        self.assertEqual(AccountTier.get_capabilities(self.user).name, 'Basic')
+        self.account_tier.change_account_tier(self.second_tier_class)
+        capabilities = AccountTier.get_capabilities(self.user)
+        self.assertEqual(capabilities.name, 'Pro')
+        self.assertTrue(capabilities.original_image)
+        self.assertEqual(capabilities.heights, (800, 400, 200, 100))
+
+    def test_get_capabilities_after_thumbnail_sizes_change(self):
+        self.assertEqual(AccountTier.get_capabilities(self.user).heights, (200, 100))
+        self.tier_class.thumbnail_sizes.add(self.thumbnails[3])
+        self.assertEqual(AccountTier.get_capabilities(self.user).heights, (800, 200, 100))
+        self.tier_class.thumbnail_sizes.remove(self.thumbnails[0])
+        self.assertEqual(AccountTier.get_capabilities(self.user).heights, (800, 200))
+
+    def test_get_capabilities_after_tier_class_change(self):
+        self.assertFalse(AccountTier.get_capabilities(self.user).original_image)
+        self.tier_class.original_image = True
+        self.tier_class.save()
+        self.assertTrue(AccountTier.get_capabilities(self.user).original_image)
+
+    def test_get_capabilities_after_encoding_profile_change(self):
+        self.assertIsNone(AccountTier.get_encoding_profile(self.user))
+        profile = EncodingProfile.objects.create(name='Fast', quality=60)
+        self.tier_class.encoding_profile = profile
+        self.tier_class.save()
+        self.assertEqual(AccountTier.get_encoding_profile(self.user).quality, 60)
+        profile.quality = 90
+        profile.save()
+        self.assertEqual(AccountTier.get_encoding_profile(self.user).quality, 90)
+        profile.delete()
+        self.assertIsNone(AccountTier.get_encoding_profile(self.user))
+
+    def test_get_encoding_profile_without_account_tier(self):
+        user = User(username='User1', password='Password')
+        user.save()
+        self.assertIsNone(AccountTier.get_encoding_profile(user))
+
+    def test_get_capabilities_after_account_tier_delete(self):
+        AccountTier.get_capabilities(self.user)
+        self.account_tier.delete()
+        self.assertRaises(AccountTier.DoesNotExist, AccountTier.get_capabilities, self.user)
@@ -0,0 +1,158 @@
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.test import override_settings
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image as PILImage
+import io
+import os
+from ..views import BulkUploadViewSet
+from ..functions import shutdown_pool, render_batch
+from ..models import ThumbnailSize, AccountTierClass, AccountTier, Thumbnail, ThumbnailJob, Image
+
+
+def create_file(color, name='uploaded_file.jpg', format='jpeg', content_type='image/jpeg'):
+    img_bytes = io.BytesIO()
+    PILImage.new('RGB', (1000, 500), color=color).save(img_bytes, format=format)
+    return SimpleUploadedFile(name, img_bytes.getvalue(), content_type=content_type)
+
+
+def create_corrupt_png():
+    img_bytes = io.BytesIO()
+    PILImage.effect_noise((400, 200), 64).convert('RGB').save(img_bytes, format='png')
+    content = bytearray(img_bytes.getvalue())
+    start = content.index(b'IDAT') + 200
+    content[start:start + 100] = bytes(100)
+    return SimpleUploadedFile('photo.png', bytes(content), content_type='image/png')
+
+
+def remove_media():
+    for name in set(Image.objects.exclude(url='').values_list('url', flat=True)):
+        os.remove('media/' + name)
+    for name in set(Thumbnail.objects.exclude(url='').values_list('url', flat=True)):
+        os.remove('media/' + name)
+
+
+class BulkUploadViewSetTestCase(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = BulkUploadViewSet.as_view({'post': 'create'})
+        self.user = User(username='test', password='test')
+        self.user.save()
+        self.thumbnail_sizes = [ThumbnailSize.get_or_create_validated(size) for size in [200, 400]]
+        self.tier_class = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=self.thumbnail_sizes,
+                                                                   original_image=True)
+        AccountTier.add_user_to_account_tier(self.tier_class, self.user)
+
+    def tearDown(self):
+        remove_media()
+        shutdown_pool()
+
+    def upload(self, files):
+        request = self.factory.post('upload/bulk/', {'files': files})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        return self.view(request)
+
+    def test_bulk_upload(self):
+        response = self.upload([create_file('red'), create_file('green', 'photo.png', 'png', 'image/png'),
+                                create_file('blue')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.data['results']], [201] * 3)
+        self.assertEqual([result['file'] for result in response.data['results']],
+                         ['uploaded_file.jpg', 'photo.png', 'uploaded_file.jpg'])
+        self.assertEqual(Image.objects.count(), 3)
+        self.assertEqual(Thumbnail.objects.filter(status=Thumbnail.Status.READY).count(), 6)
+        for result in response.data['results']:
+            image = Image.objects.get(name=result['image']['name'])
+            self.assertTrue(os.path.exists('media/' + image.url.name))
+            self.assertEqual([thumbnail['size'] for thumbnail in result['image']['thumbnails']], ['400px', '200px'])
+            for thumbnail in image.thumbnail_set.all():
+                with PILImage.open('media/' + thumbnail.url.name) as stored:
+                    self.assertEqual(stored.size, (thumbnail.thumbnail_size.height * 2,
+                                                   thumbnail.thumbnail_size.height))
+
+    @override_settings(THUMBNAIL_PARALLEL=True, THUMBNAIL_POOL_SIZE=1)
+    def test_bulk_upload_in_parallel(self):
+        response = self.upload([create_file(color) for color in ['red', 'green', 'blue', 'white']])
+        self.assertEqual(response.status_code, 201)
+        for thumbnail in Thumbnail.objects.select_related('thumbnail_size'):
+            with PILImage.open('media/' + thumbnail.url.name) as stored:
+                self.assertEqual(stored.size, (thumbnail.thumbnail_size.height * 2, thumbnail.thumbnail_size.height))
+
+    def test_bulk_upload_with_rejected_files(self):
+        response = self.upload([create_file('red'), create_file('green', content_type='image/gif'),
+                                SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg'),
+                                create_file('blue', 'photo.gif')])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 415, 422, 422])
+        self.assertEqual(response.data['results'][2]['message'],
+                         'File is corrupt or does not match its media type and extension')
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(Thumbnail.objects.count(), 2)
+
+    def test_bulk_upload_with_undecodable_file(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload([create_file('red'), create_corrupt_png(), create_file('blue')])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 422, 201])
+        self.assertEqual(response.data['results'][1]['message'],
+                         'File is corrupt or does not match its media type and extension')
+        self.assertEqual(Image.objects.count(), 2)
+        self.assertEqual(Thumbnail.objects.filter(status=Thumbnail.Status.READY).count(), 4)
+        self.assertEqual(len(os.listdir('media/images')), 2)
+        self.assertEqual(len(os.listdir('media/thumbnails')), 4)
+
+    @override_settings(THUMBNAIL_PARALLEL=True, THUMBNAIL_POOL_SIZE=1)
+    def test_bulk_upload_with_undecodable_file_in_parallel(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload([create_corrupt_png(), create_file('red'), create_file('green'),
+                                    create_file('blue')])
+        self.assertEqual([result['status'] for result in response.data['results']], [422, 201, 201, 201])
+        self.assertEqual(Image.objects.count(), 3)
+        self.assertEqual(len(os.listdir('media/images')), 3)
+
+    def test_bulk_upload_duplicates(self):
+        content = create_file('red').read()
+        files = [SimpleUploadedFile('uploaded_file.jpg', content, content_type='image/jpeg') for _ in range(2)]
+        with mock.patch('image_app.models.render_batch', wraps=render_batch) as mocked:
+            response = self.upload(files)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mocked.call_args[0][0]), 1)
+        image, duplicate = Image.objects.order_by('pk')
+        self.assertEqual(duplicate.url.name, image.url.name)
+        self.assertEqual(Thumbnail.objects.count(), 4)
+        self.assertEqual(Thumbnail.objects.values('url').distinct().count(), 2)
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_bulk_upload_async(self):
+        response = self.upload([create_file('red'), create_file('blue')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ThumbnailJob.objects.count(), 2)
+        self.assertEqual([thumbnail['status'] for thumbnail in response.data['results'][0]['image']['thumbnails']],
+                         ['pending', 'pending'])
+
+    def test_failed_bulk_upload_rolls_back_rows_and_files(self):
+        with mock.patch('image_app.models.render_batch', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, self.upload, [create_file('red'), create_file('blue')])
+        self.assertEqual(Image.objects.count(), 0)
+        self.assertEqual(Thumbnail.objects.count(), 0)
+        self.assertEqual(os.listdir('media/images'), [])
+        self.assertEqual(os.listdir('media/thumbnails'), [])
+
+    def test_bulk_upload_without_files(self):
+        response = self.upload([])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['message'], 'Images not send')
+
+    @override_settings(BULK_UPLOAD_MAX_FILES=2)
+    def test_bulk_upload_too_many_files(self):
+        response = self.upload([create_file('red'), create_file('green'), create_file('blue')])
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Image.objects.count(), 0)
+
+    def test_bulk_upload_without_account_tier(self):
+        AccountTier.objects.all().delete()
+        response = self.upload([create_file('red')])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Image.objects.count(), 0)
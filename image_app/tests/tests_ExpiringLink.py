@@ -1,4 +1,6 @@
 from django.test import TestCase
+from django.utils import timezone
+from unittest import mock
 from django.contrib.auth.models import User
 from django.core.files import File
 from PIL import Image as PILImage
@@ -64,3 +66,52 @@ class ExpiringLinkTestCase(TestCase):
             self.assertRaises(TypeError, ExpiringLink.generate, self.image, value)
         self.assertEqual(ExpiringLink.objects.count(), 0)
         os.remove('media/' + self.image.url.name)
+
+    def test_generate_signed_expiring_link(self):
+        link = ExpiringLink.generate_signed(self.image, 400)
+        self.assertIsInstance(link, ExpiringLink)
+        self.assertTrue(ExpiringLink.is_signed(link.name))
+        self.assertEqual(ExpiringLink.objects.count(), 0)
+        with self.assertNumQueries(0):
+            verified = ExpiringLink.from_signed(link.name)
+        self.assertEqual(verified.image.pk, self.image.pk)
+        self.assertEqual(verified.image.name, self.image.name)
+        self.assertEqual(verified.image.url.name, self.image.url.name)
+        self.assertEqual(int(verified.expiring_time.timestamp()), int(link.expiring_time.timestamp()))
+        os.remove('media/' + self.image.url.name)
+
+    def test_signed_expiring_link_with_tampered_name(self):
+        link = ExpiringLink.generate_signed(self.image, 400)
+        payload, signature = link.name.split(ExpiringLink.SIGNING_SEP)
+        tampered_signature = ('B' if signature[0] == 'A' else 'A') + signature[1:]
+        for name in [payload + ExpiringLink.SIGNING_SEP + tampered_signature,
+                     'A' + link.name, ExpiringLink.SIGNING_SEP, 'text~text']:
+            self.assertRaises(ExpiringLink.DoesNotExist, ExpiringLink.from_signed, name)
+        os.remove('media/' + self.image.url.name)
+
+    def test_signed_expiring_link_after_expiring_time(self):
+        link = ExpiringLink.generate_signed(self.image, 300)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timezone.timedelta(seconds=301)):
+            self.assertRaises(ExpiringLink.DoesNotExist, ExpiringLink.from_signed, link.name)
+        os.remove('media/' + self.image.url.name)
+
+    def test_generate_signed_expiring_link_with_wrong_arguments(self):
+        self.assertRaises(ValueError, ExpiringLink.generate_signed, self.image, 299)
+        self.assertRaises(TypeError, ExpiringLink.generate_signed, self.image, '400')
+        self.assertRaises(TypeError, ExpiringLink.generate_signed, 'image', 400)
+        os.remove('media/' + self.image.url.name)
+
+    def test_generate_batch(self):
+        links = ExpiringLink.generate_batch([(self.image, 400), (self.image, 30000)])
+        self.assertEqual(ExpiringLink.objects.filter(image=self.image).count(), 2)
+        self.assertEqual(links[1].expiring_time - links[0].expiring_time, timezone.timedelta(seconds=29600))
+        signed = ExpiringLink.generate_batch([(self.image, 400)], signed=True)
+        self.assertEqual(ExpiringLink.from_signed(signed[0].name).image.pk, self.image.pk)
+        self.assertEqual(ExpiringLink.objects.count(), 2)
+        os.remove('media/' + self.image.url.name)
+
+    def test_generate_batch_with_wrong_arguments(self):
+        self.assertRaises(ValueError, ExpiringLink.generate_batch, [(self.image, 400), (self.image, 299)])
+        self.assertRaises(TypeError, ExpiringLink.generate_batch, [(self.image, 400), ('image', 400)], True)
+        self.assertEqual(ExpiringLink.objects.count(), 0)
+        os.remove('media/' + self.image.url.name)
@@ -0,0 +1,60 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management import call_command
+from PIL import Image as PILImage
+import io
+import os
+from ..models import Thumbnail, Image, AccountTier, AccountTierClass, ThumbnailSize
+
+
+class GcMediaTestCase(TestCase):
+    def setUp(self):
+        sizes = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200]]
+        tier = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=sizes, original_image=True)
+        self.user = User(username='user', password='password')
+        self.user.save()
+        AccountTier.add_user_to_account_tier(tier, self.user)
+        img_bytes = io.BytesIO()
+        PILImage.new('RGB', (1000, 500), color='red').save(img_bytes, format='jpeg')
+        file = File(img_bytes, name='uploaded_file.jpg')
+        self.image = Image.create_image(self.user, file)
+        self.thumbnails = Thumbnail.create_thumbnails(self.image, sizes, file)
+        self.orphans = ['media/images/orphan.jpg', 'media/thumbnails/orphan_100.jpg', 'media/tmp/orphan.upload']
+        os.makedirs('media/tmp', exist_ok=True)
+        for path in self.orphans:
+            with open(path, 'wb') as orphan:
+                orphan.write(b'orphan')
+
+    def tearDown(self):
+        for path in self.orphans:
+            if os.path.exists(path):
+                os.remove(path)
+        for name in [self.image.url.name] + [thumbnail.url.name for thumbnail in self.thumbnails]:
+            os.remove('media/' + name)
+
+    def gc_media(self, **options):
+        output = io.StringIO()
+        call_command('gc_media', stdout=output, **options)
+        return output.getvalue()
+
+    def test_remove_orphans(self):
+        output = self.gc_media(min_age=0)
+        self.assertIn('Removed 3 of 6 files (18 bytes)', output)
+        for path in self.orphans:
+            self.assertFalse(os.path.exists(path))
+        for name in [self.image.url.name] + [thumbnail.url.name for thumbnail in self.thumbnails]:
+            self.assertTrue(os.path.exists('media/' + name))
+
+    def test_dry_run(self):
+        output = self.gc_media(min_age=0, dry_run=True)
+        self.assertIn('Would remove images/orphan.jpg', output)
+        self.assertIn('Would remove 3 of 6 files (18 bytes)', output)
+        for path in self.orphans:
+            self.assertTrue(os.path.exists(path))
+
+    def test_keep_recent_orphans(self):
+        output = self.gc_media()
+        self.assertIn('Removed 0 of 6 files (0 bytes)', output)
+        for path in self.orphans:
+            self.assertTrue(os.path.exists(path))
@@ -1,4 +1,7 @@
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User, AnonymousUser
 from django.core.files.uploadedfile import SimpleUploadedFile
 from datetime import datetime
@@ -42,6 +45,33 @@ class GenerateExpiringLinkTestCase(APITestCase):
         self.assertEqual(datetime.strftime(link.expiring_time, "%H:%M:%S %d.%m.%y"), response.data['expiring_time'])
         os.remove('media/' + image.url.name)
 
+    def test_generate_signed_expiring_link(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[2], self.user)
+        image = Image.create_image(self.user, self.file)
+        request = self.factory.post('link/', {'image_name': image.name, 'seconds': 300, 'signed': True},
+                                    format='json')
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ExpiringLink.objects.count(), 0)
+        link = ExpiringLink.from_signed(response.data['url'].split('/')[-1])
+        self.assertEqual(link.image.pk, image.pk)
+        self.assertEqual(datetime.strftime(link.expiring_time, "%H:%M:%S %d.%m.%y"), response.data['expiring_time'])
+        os.remove('media/' + image.url.name)
+
+    def test_generate_expiring_link_with_not_valid_signed_flag(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[2], self.user)
+        image = Image.create_image(self.user, self.file)
+        request = self.factory.post('link/', {'image_name': image.name, 'seconds': 300, 'signed': 'text'},
+                                    format='json')
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(ExpiringLink.objects.count(), 0)
+        os.remove('media/' + image.url.name)
+
     def test_generate_expiring_link_to_image_multiple_times(self):
         AccountTier.add_user_to_account_tier(self.account_tier_classes[2], self.user)
         image = Image.create_image(self.user, self.file)
@@ -79,7 +109,7 @@ class GenerateExpiringLinkTestCase(APITestCase):
         self.assertIn(link.name, response.data['url'])
         self.assertEqual(datetime.strftime(link.expiring_time, "%H:%M:%S %d.%m.%y"), response.data['expiring_time'])
 
-        img = PILImage.new('RGB', (1000, 1000), color='red')
+        img = PILImage.new('RGB', (1000, 1000), color='blue')
         img_bytes = io.BytesIO()
         img.save(img_bytes, format='jpeg')
         file = SimpleUploadedFile('uploaded_file.jpg', img_bytes.getvalue(), content_type='image/jpeg')
@@ -498,3 +528,108 @@ class GenerateExpiringLinkTestCase(APITestCase):
         self.assertEqual(ExpiringLink.objects.count(), 0)
         self.assertEqual(ExpiringLink.objects.filter(image=image).count(), 0)
         os.remove('media/' + image.url.name)
+
+
+class GenerateExpiringLinkBatchTestCase(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = GenerateExpiringLink.as_view({'post': 'create_batch'})
+        self.user = User(username='test', password='test')
+        self.user.save()
+        thumbnail_sizes = [ThumbnailSize.get_or_create_validated(200)]
+        self.tier_class = AccountTierClass.get_or_create_validated(name='Enterprise', thumbnail_sizes=thumbnail_sizes,
+                                                                   original_image=True, expiring_link=True)
+        AccountTier.add_user_to_account_tier(self.tier_class, self.user)
+        self.images = []
+        for color in ['red', 'green', 'blue']:
+            img_bytes = io.BytesIO()
+            PILImage.new('RGB', (100, 100), color=color).save(img_bytes, format='jpeg')
+            self.images.append(Image.create_image(self.user, SimpleUploadedFile(
+                'uploaded_file.jpg', img_bytes.getvalue(), content_type='image/jpeg')))
+
+    def tearDown(self):
+        for image in self.images:
+            os.remove('media/' + image.url.name)
+
+    def assertServesImage(self, url, image):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with open('media/' + image.url.name, 'rb') as stored:
+            self.assertEqual(b''.join(response.streaming_content), stored.read())
+
+    def generate(self, data):
+        request = self.factory.post('link/bulk/', data, format='json')
+        force_authenticate(request, self.user)
+        request.user = self.user
+        return self.view(request)
+
+    def test_generate_expiring_links(self):
+        response = self.generate({'links': [{'image_name': image.name, 'seconds': 300} for image in self.images] +
+                                           [{'image_name': self.images[0].name, 'seconds': '600'}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ExpiringLink.objects.count(), 4)
+        self.assertEqual(ExpiringLink.objects.filter(image=self.images[0]).count(), 2)
+        for result, image in zip(response.data['links'], self.images + self.images[:1]):
+            self.assertEqual(result['status'], 200)
+            self.assertEqual(result['image_name'], image.name)
+            self.assertTrue(result['url'].startswith('http://testserver/link/'))
+            link = ExpiringLink.objects.get(name=result['url'].split('/')[-1])
+            self.assertEqual(link.image, image)
+            self.assertServesImage(result['url'], image)
+            self.assertEqual(datetime.strftime(link.expiring_time, "%H:%M:%S %d.%m.%y"), result['expiring_time'])
+
+    def test_generate_signed_expiring_links(self):
+        response = self.generate({'links': [{'image_name': image.name, 'seconds': 300} for image in self.images],
+                                  'signed': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ExpiringLink.objects.count(), 0)
+        for result, image in zip(response.data['links'], self.images):
+            link = ExpiringLink.from_signed(result['url'].split('/')[-1])
+            self.assertEqual(link.image.pk, image.pk)
+            self.assertEqual(link.image.url.name, image.url.name)
+            self.assertServesImage(result['url'], image)
+
+    def test_generate_expiring_links_with_constant_queries(self):
+        queries = []
+        for count in [1, 30]:
+            with CaptureQueriesContext(connection) as context:
+                response = self.generate({'links': [{'image_name': image.name, 'seconds': 300}
+                                                    for image in self.images] * count})
+            self.assertEqual(response.status_code, 200)
+            queries.append(len(context.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(ExpiringLink.objects.count(), 93)
+
+    def test_generate_expiring_links_with_rejected_links(self):
+        image = Image(name='without_original.jpg', owner=self.user)
+        image.save()
+        response = self.generate({'links': [
+            {'image_name': self.images[0].name, 'seconds': 300}, {'image_name': 'missing.jpg', 'seconds': 300},
+            {'image_name': image.name, 'seconds': 300}, {'image_name': self.images[1].name, 'seconds': 299},
+            {'image_name': self.images[1].name, 'seconds': None}, {'image_name': 1, 'seconds': 300},
+            {'seconds': 300}, 'link']})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data['links']],
+                         [200, 404, 409, 422, 422, 422, 422, 422])
+        self.assertEqual(response.data['links'][1]['message'], 'Image does not exists')
+        self.assertEqual(ExpiringLink.objects.count(), 1)
+
+    def test_generate_expiring_links_with_not_valid_arguments(self):
+        for data in [{}, {'links': 'link'}, {'links': {}}, [], {'links': [], 'signed': 'maybe'}]:
+            response = self.generate(data)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(response.data['message'], 'Not valid arguments')
+        with override_settings(EXPIRING_LINK_BATCH_MAX=2):
+            response = self.generate({'links': [{'image_name': image.name, 'seconds': 300} for image in self.images]})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(ExpiringLink.objects.count(), 0)
+
+    def test_generate_expiring_links_without_permission(self):
+        self.tier_class.expiring_link = False
+        self.tier_class.save()
+        response = self.generate({'links': [{'image_name': self.images[0].name, 'seconds': 300}]})
+        self.assertEqual(response.status_code, 403)
+        AccountTier.objects.all().delete()
+        response = self.generate({'links': [{'image_name': self.images[0].name, 'seconds': 300}]})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(ExpiringLink.objects.count(), 0)
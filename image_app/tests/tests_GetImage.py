@@ -1,4 +1,5 @@
 from rest_framework.test import APITestCase, APIRequestFactory
+from django.test import override_settings
 from django.contrib.auth.models import User, AnonymousUser
 from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -34,7 +35,7 @@ class GetImageTestCase(APITestCase):
         response = self.view(request, link.name).get('content-type')
         self.assertEqual(response, 'image/jpeg')
 
-        img = PILImage.new('RGB', (1000, 1000), color='red')
+        img = PILImage.new('RGB', (1000, 1000), color='blue')
         img_bytes = io.BytesIO()
         img.save(img_bytes, format='jpeg')
         self.file = SimpleUploadedFile('uploaded_file.png', img_bytes.getvalue(), content_type='image/png')
@@ -77,3 +78,104 @@ class GetImageTestCase(APITestCase):
             self.assertEqual(response.status_code, 404)
             self.assertEqual(response.data['message'], 'Resource not found')
         os.remove('media/' + image.url.name)
+
+    def test_get_image_streams_whole_file(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate(image, 300)
+        request = self.factory.get('link/')
+        request.user = AnonymousUser
+        response = self.view(request, link.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), image.url.size)
+        with open('media/' + image.url.name, 'rb') as file:
+            self.assertEqual(b''.join(response.streaming_content), file.read())
+        os.remove('media/' + image.url.name)
+
+    def test_get_image_range(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate(image, 300)
+        with open('media/' + image.url.name, 'rb') as file:
+            content = file.read()
+        for header, start, end in [('bytes=0-99', 0, 99), ('bytes=100-', 100, len(content) - 1),
+                                   ('bytes=-50', len(content) - 50, len(content) - 1),
+                                   ('bytes=10-99999999', 10, len(content) - 1)]:
+            request = self.factory.get('link/', HTTP_RANGE=header)
+            request.user = AnonymousUser
+            response = self.view(request, link.name)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes %d-%d/%d' % (start, end, len(content)))
+            self.assertEqual(int(response['Content-Length']), end - start + 1)
+            self.assertEqual(b''.join(response.streaming_content), content[start:end + 1])
+        os.remove('media/' + image.url.name)
+
+    def test_get_image_with_unsatisfiable_range(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate(image, 300)
+        request = self.factory.get('link/', HTTP_RANGE='bytes=99999999-')
+        request.user = AnonymousUser
+        response = self.view(request, link.name)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % image.url.size)
+        os.remove('media/' + image.url.name)
+
+    def test_get_image_with_not_valid_range_header(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate(image, 300)
+        request = self.factory.get('link/', HTTP_RANGE='bytes=0-10,20-30')
+        request.user = AnonymousUser
+        response = self.view(request, link.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), image.url.size)
+        response.file_to_stream.close()
+        os.remove('media/' + image.url.name)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_URL='/protected/')
+    def test_get_image_with_accel_redirect(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate(image, 300)
+        request = self.factory.get('link/')
+        request.user = AnonymousUser
+        response = self.view(request, link.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + image.url.name)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, b'')
+        os.remove('media/' + image.url.name)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_URL='/protected/')
+    def test_get_image_with_accel_redirect_and_expired_link(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate(image, 300)
+        link.expiring_time = timezone.now() - timedelta(seconds=5)
+        link.save()
+        request = self.factory.get('link/')
+        request.user = AnonymousUser
+        response = self.view(request, link.name)
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', response)
+        os.remove('media/' + image.url.name)
+
+    def test_get_image_with_signed_link(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate_signed(image, 300)
+        request = self.factory.get('link/')
+        request.user = AnonymousUser
+        with self.assertNumQueries(0):
+            response = self.view(request, link.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with open('media/' + image.url.name, 'rb') as file:
+            self.assertEqual(b''.join(response.streaming_content), file.read())
+        os.remove('media/' + image.url.name)
+
+    def test_get_image_with_tampered_signed_link(self):
+        image = Image.create_image(self.user, self.file)
+        link = ExpiringLink.generate_signed(image, 300)
+        request = self.factory.get('link/')
+        request.user = AnonymousUser
+        response = self.view(request, link.name[:-1])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['message'], 'Resource not found')
+        os.remove('media/' + image.url.name)
@@ -54,6 +54,50 @@ class ImageTestCase(TestCase):
         self.assertEqual(Image.objects.filter(owner=self.user).count(), 1)
         os.remove('media/' + image.url.name)
 
+    def test_create_duplicate_image_reuses_original(self):
+        self.tier_class.original_image = True
+        self.tier_class.save()
+        image = Image.create_image(owner=self.user, file=self.file)
+        duplicate = Image.create_image(owner=self.user, file=self.file)
+        self.assertNotEqual(duplicate.name, image.name)
+        self.assertEqual(duplicate.content_hash, image.content_hash)
+        self.assertEqual(duplicate.url.name, image.url.name)
+        self.assertEqual(os.listdir('media/images'), [os.path.basename(image.url.name)])
+        os.remove('media/' + image.url.name)
+
+    def test_duplicate_of_other_users_image_is_stored(self):
+        self.tier_class.original_image = True
+        self.tier_class.save()
+        image = Image.create_image(owner=self.user, file=self.file)
+        other_user = User.objects.create(username='Other', password='Password')
+        AccountTier.add_user_to_account_tier(tier=self.tier_class, user=other_user)
+        duplicate = Image.create_image(owner=other_user, file=self.file)
+        self.assertEqual(duplicate.url.name, 'images/' + duplicate.name)
+        self.assertTrue(duplicate.url.name.startswith('images/' + str(other_user.pk)))
+        for stored in [image, duplicate]:
+            os.remove('media/' + stored.url.name)
+
+    def test_duplicate_of_missing_original_is_stored(self):
+        self.tier_class.original_image = True
+        self.tier_class.save()
+        image = Image.create_image(owner=self.user, file=self.file)
+        os.remove('media/' + image.url.name)
+        duplicate = Image.create_image(owner=self.user, file=self.file)
+        self.assertEqual(duplicate.url.name, 'images/' + duplicate.name)
+        os.remove('media/' + duplicate.url.name)
+
+    def test_stored_original_is_deleted_with_last_reference(self):
+        self.tier_class.original_image = True
+        self.tier_class.save()
+        image = Image.create_image(owner=self.user, file=self.file)
+        duplicate = Image.create_image(owner=self.user, file=self.file)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertTrue(os.path.exists('media/' + duplicate.url.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            duplicate.delete()
+        self.assertFalse(os.path.exists('media/' + duplicate.url.name))
+
     def test_create_image_with_png_extension(self):
         img = PILImage.new('RGB', (1000, 1000), color='red')
         img_bytes = io.BytesIO()
@@ -90,3 +134,26 @@ class ImageTestCase(TestCase):
         for value in values:
             self.assertRaises(TypeError, Image.create_image, self.user, value)
         self.assertEqual(Image.objects.count(), 0)
+
+    def test_create_images(self):
+        self.tier_class.original_image = True
+        self.tier_class.save()
+        image = Image.create_image(owner=self.user, file=self.file)
+        img_bytes = io.BytesIO()
+        PILImage.new('RGB', (1000, 1000), color='blue').save(img_bytes, format='png')
+        files = [File(img_bytes, name='uploaded_file.png'), self.file, File(img_bytes, name='uploaded_file.png')]
+        images = Image.create_images(owner=self.user, files=files)
+        self.assertEqual([created.pk for created in images], list(Image.objects.exclude(pk=image.pk)
+                                                                  .order_by('pk').values_list('pk', flat=True)))
+        self.assertTrue(images[0].name.endswith('.png'))
+        self.assertEqual(images[1].url.name, image.url.name)
+        self.assertEqual(images[2].url.name, images[0].url.name)
+        self.assertNotEqual(images[0].url.name, image.url.name)
+        os.remove('media/' + image.url.name)
+        os.remove('media/' + images[0].url.name)
+
+    def test_create_images_with_invalid_arguments(self):
+        self.assertRaises(TypeError, Image.create_images, None, [self.file])
+        self.assertRaises(TypeError, Image.create_images, self.user, [self.file, 'file'])
+        self.assertRaises(ValueError, Image.create_images, self.user, [File(self.file, name='uploaded_file.gif')])
+        self.assertEqual(Image.objects.count(), 0)
@@ -1,10 +1,16 @@
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.test import override_settings
 from django.contrib.auth.models import User, AnonymousUser
+from django.core.files import File
 from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
 from PIL import Image as PILImage
 import io
-from ..views import ImagesViewSet
-from ..models import ThumbnailSize, AccountTierClass, AccountTier, Image
+import os
+import tempfile
+from ..cache import listing_cache
+from ..views import ImagesViewSet, ImagesWithDetailsViewSet
+from ..models import ThumbnailSize, AccountTierClass, AccountTier, Image, Thumbnail, ThumbnailJob
 
 
 def create_image():
@@ -16,6 +22,7 @@ def create_image():
 
 class ImagesViewSetTestCase(APITestCase):
     def setUp(self):
+        listing_cache.cache.clear()
         self.factory = APIRequestFactory()
         self.view = ImagesViewSet.as_view({'get': 'get'})
         self.user = User(username='test', password='test')
@@ -31,7 +38,7 @@ class ImagesViewSetTestCase(APITestCase):
         request.user = self.user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
 
     def test_with_images(self):
         for i in range(20):
@@ -41,7 +48,7 @@ class ImagesViewSetTestCase(APITestCase):
         request.user = self.user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), Image.objects.count())
+        self.assertEqual(len(response.data['results']), Image.objects.count())
 
     def test_with_other_user_images(self):
         for i in range(20):
@@ -53,7 +60,7 @@ class ImagesViewSetTestCase(APITestCase):
         request.user = user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), Image.objects.filter(owner=user).count())
+        self.assertEqual(len(response.data['results']), Image.objects.filter(owner=user).count())
         self.assertEqual(Image.objects.count(), 20)
 
     def test_with_both_other_user_images_and_own(self):
@@ -69,7 +76,7 @@ class ImagesViewSetTestCase(APITestCase):
         request.user = user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), Image.objects.filter(owner=user).count())
+        self.assertEqual(len(response.data['results']), Image.objects.filter(owner=user).count())
         self.assertEqual(Image.objects.count(), 30)
 
     def test_without_authentication(self):
@@ -77,3 +84,159 @@ class ImagesViewSetTestCase(APITestCase):
         request.user = AnonymousUser()
         response = self.view(request)
         self.assertEqual(response.status_code, 302)
+
+    def test_pagination(self):
+        for i in range(25):
+            Image.create_image(self.user, create_image())
+        names = []
+        url = 'images/?page_size=10'
+        while url:
+            request = self.factory.get(url)
+            force_authenticate(request, self.user)
+            request.user = self.user
+            response = self.view(request)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 10)
+            names += [image['name'] for image in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, list(Image.objects.order_by('-pk').values_list('name', flat=True)))
+
+    def test_pagination_previous_page(self):
+        for i in range(15):
+            Image.create_image(self.user, create_image())
+        request = self.factory.get('images/?page_size=10')
+        force_authenticate(request, self.user)
+        request.user = self.user
+        first_page = self.view(request)
+        self.assertIsNone(first_page.data['previous'])
+        request = self.factory.get(first_page.data['next'])
+        force_authenticate(request, self.user)
+        request.user = self.user
+        second_page = self.view(request)
+        self.assertEqual(len(second_page.data['results']), 5)
+        self.assertIsNone(second_page.data['next'])
+        request = self.factory.get(second_page.data['previous'])
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.data['results'], first_page.data['results'])
+
+    def test_list_returns_only_own_images(self):
+        for i in range(5):
+            Image.create_image(self.user, create_image())
+        user = User(username='test1', password='test1')
+        user.save()
+        view = ImagesViewSet.as_view({'get': 'list'})
+        request = self.factory.get('images/')
+        force_authenticate(request, user)
+        request.user = user
+        response = view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+
+class ListingCacheTestCase(APITestCase):
+    def setUp(self):
+        listing_cache.cache.clear()
+        self.factory = APIRequestFactory()
+        self.view = ImagesViewSet.as_view({'get': 'get'})
+        self.details_view = ImagesWithDetailsViewSet.as_view({'get': 'get'})
+        self.user = User(username='test', password='test')
+        self.user.save()
+        self.thumbnail_size = ThumbnailSize.get_or_create_validated(200)
+        self.account_tier_class = AccountTierClass.get_or_create_validated(name='Basic',
+                                                                           thumbnail_sizes=[self.thumbnail_size])
+        AccountTier.add_user_to_account_tier(self.account_tier_class, self.user)
+
+    def get(self, view, user, url='images/'):
+        request = self.factory.get(url)
+        force_authenticate(request, user)
+        request.user = user
+        return view(request)
+
+    def test_second_request_is_cached(self):
+        Image.create_image(self.user, create_image())
+        stats = listing_cache.stats()
+        response = self.get(self.view, self.user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            cached = self.get(self.view, self.user)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(listing_cache.stats(), {'hits': stats['hits'] + 1, 'misses': stats['misses'] + 1})
+
+    def test_new_image_invalidates_cache(self):
+        self.get(self.view, self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Image.create_image(self.user, create_image())
+        response = self.get(self.view, self.user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_deleted_image_invalidates_cache(self):
+        image = Image.create_image(self.user, create_image())
+        self.get(self.view, self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        response = self.get(self.view, self.user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'], [])
+
+    def test_thumbnail_invalidates_details_cache(self):
+        file = create_image()
+        image = Image.create_image(self.user, file)
+        self.assertEqual(self.get(self.details_view, self.user, 'images/details/').data['results'][0]['thumbnails'],
+                         [])
+        with self.captureOnCommitCallbacks(execute=True):
+            thumbnails = Thumbnail.create_thumbnails(image, [self.thumbnail_size], file)
+        response = self.get(self.details_view, self.user, 'images/details/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['thumbnails'][0]['name'], thumbnails[0].name)
+        os.remove('media/' + thumbnails[0].url.name)
+
+    @override_settings(THUMBNAIL_JOB_MAX_ATTEMPTS=1)
+    def test_failed_job_invalidates_details_cache(self):
+        image = Image.create_image(self.user, create_image())
+        job = ThumbnailJob.enqueue(image, [self.thumbnail_size], File(io.BytesIO(b'broken'), name='broken.jpg'))
+        self.assertEqual(self.get(self.details_view, self.user, 'images/details/')
+                         .data['results'][0]['thumbnails'][0]['status'], 'pending')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(ThumbnailJob.claim('worker').run())
+        response = self.get(self.details_view, self.user, 'images/details/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['thumbnails'][0]['status'], 'failed')
+        self.assertFalse(os.path.exists('media/' + job.source.name))
+
+    def test_invalidation_waits_for_commit(self):
+        self.get(self.view, self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Image.create_image(self.user, create_image())
+            self.assertEqual(self.get(self.view, self.user)['X-Cache'], 'HIT')
+        self.assertEqual(self.get(self.view, self.user)['X-Cache'], 'MISS')
+
+    def test_listing_is_cached_under_the_version_it_was_read_at(self):
+        with mock.patch.object(listing_cache, 'version', side_effect=[1, 2, 2]):
+            self.get(self.view, self.user)
+            self.assertEqual(self.get(self.view, self.user)['X-Cache'], 'MISS')
+
+    def test_cache_is_per_user_and_url(self):
+        Image.create_image(self.user, create_image())
+        user = User(username='test1', password='test1')
+        user.save()
+        self.get(self.view, self.user)
+        self.assertEqual(self.get(self.view, user)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(self.view, user).data['results'], [])
+        self.assertEqual(self.get(self.view, self.user, 'images/?page_size=1')['X-Cache'], 'MISS')
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'listings': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+                Image.create_image(self.user, create_image())
+                self.assertEqual(self.get(self.view, self.user)['X-Cache'], 'MISS')
+                self.assertEqual(self.get(self.view, self.user)['X-Cache'], 'HIT')
+                with self.captureOnCommitCallbacks(execute=True):
+                    Image.create_image(self.user, create_image())
+                response = self.get(self.view, self.user)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertEqual(len(response.data['results']), 2)
@@ -1,9 +1,11 @@
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.test import override_settings
 from django.contrib.auth.models import User, AnonymousUser
 from django.core.files.uploadedfile import SimpleUploadedFile
 from PIL import Image as PILImage
 import io
 import os
+from ..cache import listing_cache
 from ..views import ImagesWithDetailsViewSet
 from ..models import ThumbnailSize, AccountTierClass, AccountTier, Image, Thumbnail
 
@@ -17,6 +19,7 @@ def create_image():
 
 class ImagesWithDetailsViewSetTestCase(APITestCase):
     def setUp(self):
+        listing_cache.cache.clear()
         self.factory = APIRequestFactory()
         self.view = ImagesWithDetailsViewSet.as_view({'get': 'get'})
         self.user = User(username='test', password='test')
@@ -26,13 +29,32 @@ class ImagesWithDetailsViewSetTestCase(APITestCase):
                                                                            thumbnail_sizes=[self.thumbnail_size])
         AccountTier.add_user_to_account_tier(self.account_tier_class, self.user)
 
+    @override_settings(THUMBNAIL_RENDITION_FORMATS=['webp'])
+    def test_thumbnail_url_is_negotiated(self):
+        file = create_image()
+        image = Image.create_image(self.user, file)
+        thumbnail, = Thumbnail.create_thumbnails(image, [self.thumbnail_size], file)
+        urls = []
+        for accept in ['application/json,image/webp', 'application/json', 'application/json,image/webp']:
+            request = self.factory.get('images/details/', HTTP_ACCEPT=accept)
+            force_authenticate(request, self.user)
+            request.user = self.user
+            response = self.view(request)
+            self.assertEqual(response['Vary'], 'Accept')
+            urls.append(response.data['results'][0]['thumbnails'][0]['url'])
+        self.assertTrue(urls[0].endswith(thumbnail.webp.url))
+        self.assertTrue(urls[1].endswith(thumbnail.url.url))
+        self.assertEqual(urls[2], urls[0])
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + thumbnail.webp.name)
+
     def test_without_images(self):
         request = self.factory.get('images/details/')
         force_authenticate(request, self.user)
         request.user = self.user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
 
     def test_with_images(self):
         for i in range(20):
@@ -42,7 +64,7 @@ class ImagesWithDetailsViewSetTestCase(APITestCase):
         request.user = self.user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), Image.objects.count())
+        self.assertEqual(len(response.data['results']), Image.objects.count())
 
     def test_with_other_user_images(self):
         for i in range(20):
@@ -54,7 +76,7 @@ class ImagesWithDetailsViewSetTestCase(APITestCase):
         request.user = user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), Image.objects.filter(owner=user).count())
+        self.assertEqual(len(response.data['results']), Image.objects.filter(owner=user).count())
         self.assertEqual(Image.objects.count(), 20)
 
     def test_with_both_other_user_images_and_own(self):
@@ -70,7 +92,7 @@ class ImagesWithDetailsViewSetTestCase(APITestCase):
         request.user = user
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), Image.objects.filter(owner=user).count())
+        self.assertEqual(len(response.data['results']), Image.objects.filter(owner=user).count())
         self.assertEqual(Image.objects.count(), 30)
 
     def test_without_authentication(self):
@@ -79,6 +101,27 @@ class ImagesWithDetailsViewSetTestCase(APITestCase):
         response = self.view(request)
         self.assertEqual(response.status_code, 302)
 
+    def test_number_of_queries_does_not_depend_on_number_of_images(self):
+        thumbnail_size = ThumbnailSize.get_or_create_validated(400)
+        self.account_tier_class.thumbnail_sizes.add(thumbnail_size)
+        thumbnails = []
+        for count in [1, 10]:
+            with self.captureOnCommitCallbacks(execute=True):
+                while Image.objects.count() < count:
+                    file = create_image()
+                    image = Image.create_image(self.user, file)
+                    thumbnails += Thumbnail.create_thumbnails(image, [self.thumbnail_size, thumbnail_size], file)
+            request = self.factory.get('images/details/')
+            force_authenticate(request, self.user)
+            request.user = self.user
+            with self.assertNumQueries(2):
+                response = self.view(request)
+            self.assertEqual(len(response.data['results']), count)
+            sizes = [thumbnail['size'] for thumbnail in response.data['results'][0]['thumbnails']]
+            self.assertEqual(sizes, ['400px', '200px'])
+        for name in {thumbnail.url.name for thumbnail in thumbnails}:
+            os.remove('media/' + name)
+
 
 class ImagesWithDetailsViewSetGetOneTestCase(APITestCase):
     def setUp(self):
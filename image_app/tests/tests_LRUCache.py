@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+from unittest import mock
+from ..cache import LRUCache
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    def test_get_and_set(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expired_value(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        with mock.patch('image_app.cache.time.monotonic', return_value=0):
+            cache.set('a', 1)
+        with mock.patch('image_app.cache.time.monotonic', return_value=59):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('image_app.cache.time.monotonic', return_value=61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_delete_and_clear(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertIsNone(cache.get('b'))
@@ -0,0 +1,267 @@
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.test import TransactionTestCase, override_settings
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from PIL import Image as PILImage
+import io
+import os
+import time
+from .. import models
+from ..views import LazyThumbnail
+from ..models import ThumbnailSize, AccountTierClass, AccountTier, Image, Thumbnail, ThumbnailJob
+
+
+def create_image(name='uploaded_file.jpg'):
+    img = PILImage.new('RGB', (1000, 500), color='red')
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='jpeg')
+    return SimpleUploadedFile(name, img_bytes.getvalue(), content_type='image/jpeg')
+
+
+class LazyThumbnailTestCase(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = LazyThumbnail.as_view()
+        self.user = User(username='test', password='test')
+        self.user.save()
+        self.thumbnail_sizes = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200, 400]]
+        self.basic = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=self.thumbnail_sizes)
+        self.pro = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=self.thumbnail_sizes,
+                                                            original_image=True)
+
+    def get(self, image_name, height, user=None, accept=None, data=None, **headers):
+        request = self.factory.get('images/' + image_name + '/thumbnails/' + str(height), data,
+                                   HTTP_ACCEPT=accept or '*/*', **headers)
+        force_authenticate(request, user or self.user)
+        request.user = user or self.user
+        return self.view(request, image_name=image_name, height=height)
+
+    @override_settings(THUMBNAIL_RENDITION_FORMATS=['webp'])
+    def test_negotiate_rendition(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        response = self.get(image.name, 200, accept='image/avif,image/webp,image/*;q=0.8,*/*;q=0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Vary'], 'Accept')
+        with PILImage.open(io.BytesIO(b''.join(response.streaming_content))) as rendered:
+            self.assertEqual(rendered.format, 'WEBP')
+        response = self.get(image.name, 200, accept='image/webp;q=0,*/*')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        response.file_to_stream.close()
+        for accept, content_type in [('image/webp', 'image/webp'), ('image/avif', 'image/jpeg'),
+                                     ('image/png', 'image/jpeg')]:
+            response = self.get(image.name, 200, accept=accept)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], content_type)
+            response.file_to_stream.close()
+        thumbnail = Thumbnail.objects.get(image=image)
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + thumbnail.webp.name)
+        os.remove('media/' + image.url.name)
+
+    def test_conditional_get(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        response = self.get(image.name, 200)
+        response.file_to_stream.close()
+        thumbnail = Thumbnail.objects.get(image=image)
+        self.assertEqual(response['ETag'], '"%s.jpeg"' % thumbnail.content_hash[:32])
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Last-Modified', response)
+        with mock.patch('image_app.views.file_response') as file_response:
+            for headers in [{'HTTP_IF_NONE_MATCH': response['ETag']},
+                            {'HTTP_IF_NONE_MATCH': 'W/' + response['ETag'] + ', "other"'},
+                            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}]:
+                not_modified = self.get(image.name, 200, **headers)
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified['ETag'], response['ETag'])
+        file_response.assert_not_called()
+        changed = self.get(image.name, 200, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(changed.status_code, 200)
+        changed.file_to_stream.close()
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    def test_versioned_url_is_immutable(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        self.get(image.name, 200).file_to_stream.close()
+        thumbnail = Thumbnail.objects.get(image=image)
+        response = self.get(image.name, 200, data={'v': thumbnail.version, 'rendition': 'jpeg'})
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        response.file_to_stream.close()
+        response = self.get(image.name, 200, data={'v': 'outdated'})
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        response.file_to_stream.close()
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    def test_render_from_original(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        response = self.get(image.name, 200)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with PILImage.open(io.BytesIO(b''.join(response.streaming_content))) as rendered:
+            self.assertEqual(rendered.size, (400, 200))
+        thumbnail = Thumbnail.objects.get(image=image)
+        self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+        self.assertEqual(thumbnail.thumbnail_size, self.thumbnail_sizes[1])
+
+        with mock.patch.object(models, 'render_thumbnails') as render_thumbnails:
+            response = self.get(image.name, 200)
+        self.assertEqual(response.status_code, 200)
+        render_thumbnails.assert_not_called()
+        self.assertEqual(Thumbnail.objects.count(), 1)
+        response.file_to_stream.close()
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    def test_render_from_nearest_larger_thumbnail(self):
+        AccountTier.add_user_to_account_tier(self.basic, self.user)
+        file = create_image()
+        image = Image.create_image(self.user, file)
+        thumbnails = Thumbnail.create_thumbnails(image, self.thumbnail_sizes[1:], file)
+        with mock.patch.object(models, 'render_thumbnails', wraps=models.render_thumbnails) as render_thumbnails:
+            response = self.get(image.name, 100)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(render_thumbnails.call_args[0][0].name, thumbnails[1].url.name)
+        response.file_to_stream.close()
+        for thumbnail in Thumbnail.objects.all():
+            os.remove('media/' + thumbnail.url.name)
+
+    def test_render_without_source(self):
+        AccountTier.add_user_to_account_tier(self.basic, self.user)
+        image = Image.create_image(self.user, create_image())
+        response = self.get(image.name, 200)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['message'], 'No source to render thumbnail from')
+        self.assertEqual(Thumbnail.objects.get(image=image).status, Thumbnail.Status.FAILED)
+
+    def test_render_failed_thumbnail_again(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        Thumbnail(name=Thumbnail._generate_name(image, self.thumbnail_sizes[0]), image=image,
+                  thumbnail_size=self.thumbnail_sizes[0], status=Thumbnail.Status.FAILED).save()
+        response = self.get(image.name, 100)
+        self.assertEqual(response.status_code, 200)
+        thumbnail = Thumbnail.objects.get(image=image)
+        self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+        response.file_to_stream.close()
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    @override_settings(LAZY_THUMBNAIL_TIMEOUT=0)
+    def test_thumbnail_rendered_elsewhere(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        Thumbnail._create_pending(image, [self.thumbnail_sizes[0]])
+        response = self.get(image.name, 100)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        os.remove('media/' + image.url.name)
+
+    @override_settings(LAZY_THUMBNAIL_TIMEOUT=0, THUMBNAIL_RENDER_TIMEOUT=60)
+    def test_render_abandoned_thumbnail_again(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        thumbnail = Thumbnail._create_pending(image, [self.thumbnail_sizes[0]])[0]
+        Thumbnail.objects.filter(pk=thumbnail.pk).update(claimed_at=timezone.now() - timezone.timedelta(seconds=61))
+        response = self.get(image.name, 100)
+        self.assertEqual(response.status_code, 200)
+        thumbnail.refresh_from_db()
+        self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+        response.file_to_stream.close()
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    @override_settings(LAZY_THUMBNAIL_TIMEOUT=0, THUMBNAIL_RENDER_TIMEOUT=60)
+    def test_queued_thumbnail_is_not_abandoned(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        ThumbnailJob.enqueue(image, [self.thumbnail_sizes[0]], image.url)
+        Thumbnail.objects.filter(image=image).update(claimed_at=timezone.now() - timezone.timedelta(seconds=61))
+        response = self.get(image.name, 100)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Thumbnail.objects.get(image=image).status, Thumbnail.Status.PENDING)
+        os.remove('media/' + image.url.name)
+
+    def test_render_error(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        with mock.patch.object(models, 'render_thumbnails', side_effect=OSError):
+            response = self.get(image.name, 100)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data['message'], 'Thumbnail could not be rendered')
+        self.assertEqual(Thumbnail.objects.get(image=image).status, Thumbnail.Status.FAILED)
+        os.remove('media/' + image.url.name)
+
+    def test_error_with_image_only_accept(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        response = self.get('missing.jpg', 200, accept='image/webp')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.render()['Content-Type'], 'application/json')
+
+    def test_size_not_in_account_tier(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        response = self.get(image.name, 800)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['message'], 'Thumbnail size not available')
+        self.assertEqual(Thumbnail.objects.count(), 0)
+        os.remove('media/' + image.url.name)
+
+    def test_other_user_image(self):
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        image = Image.create_image(self.user, create_image())
+        user = User(username='test1', password='test1')
+        user.save()
+        AccountTier.add_user_to_account_tier(self.pro, user)
+        response = self.get(image.name, 200, user)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['message'], 'Image does not exists')
+        os.remove('media/' + image.url.name)
+
+    def test_without_authentication(self):
+        request = self.factory.get('images/image.jpg/thumbnails/200')
+        request.user = AnonymousUser()
+        response = self.view(request, image_name='image.jpg', height=200)
+        self.assertEqual(response.status_code, 302)
+
+
+class ConcurrentLazyThumbnailTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User(username='test', password='test')
+        self.user.save()
+        self.thumbnail_size = ThumbnailSize.get_or_create_validated(100)
+        tier = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=[self.thumbnail_size],
+                                                        original_image=True)
+        AccountTier.add_user_to_account_tier(tier, self.user)
+        self.image = Image.create_image(self.user, create_image())
+
+    def render(self, index):
+        try:
+            return Thumbnail.get_or_render(Image.objects.get(pk=self.image.pk), self.thumbnail_size).pk
+        finally:
+            connection.close()
+
+    def test_concurrent_first_requests_share_one_render(self):
+        def slow_render(*args, **kwargs):
+            time.sleep(0.2)
+            return render_thumbnails(*args, **kwargs)
+
+        render_thumbnails = models.render_thumbnails
+        with mock.patch.object(models, 'render_thumbnails', side_effect=slow_render) as mocked:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                pks = list(executor.map(self.render, range(8)))
+        self.assertEqual(mocked.call_count, 1)
+        self.assertEqual(len(set(pks)), 1)
+        thumbnail = Thumbnail.objects.get()
+        self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+        os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + self.image.url.name)
@@ -0,0 +1,213 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import IntegrityError
+from django.db.models.sql.compiler import SQLInsertCompiler
+from django.utils import timezone
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from PIL import Image as PILImage
+import io
+import json
+import os
+import tempfile
+from ..functions import shutdown_pool
+from ..models import Thumbnail, Image, AccountTier, AccountTierClass, ThumbnailSize, ThumbnailJob
+
+
+def create_file():
+    img = PILImage.new('RGB', (1000, 500), color='red')
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='jpeg')
+    return File(img_bytes, name='uploaded_file.jpg')
+
+
+def remove_media():
+    for name in set(Image.objects.exclude(url='').values_list('url', flat=True)):
+        os.remove('media/' + name)
+    for name in set(Thumbnail.objects.exclude(url='').values_list('url', flat=True)):
+        os.remove('media/' + name)
+
+
+class RebuildThumbnailsTestCase(TestCase):
+    def setUp(self):
+        self.sizes = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200, 400]]
+        self.basic = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=self.sizes[1:2])
+        self.pro = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=self.sizes[1:],
+                                                            original_image=True)
+        self.user = User(username='user', password='password')
+        self.user.save()
+        AccountTier.add_user_to_account_tier(self.pro, self.user)
+        self.basic_user = User(username='basic', password='password')
+        self.basic_user.save()
+        AccountTier.add_user_to_account_tier(self.basic, self.basic_user)
+        self.images = []
+        for user in [self.user, self.basic_user, self.user]:
+            file = create_file()
+            image = Image.create_image(user, file)
+            Thumbnail.create_thumbnails(image, list(AccountTier.get_capabilities(user).thumbnail_sizes), file)
+            self.images.append(image)
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+
+    def tearDown(self):
+        remove_media()
+        os.rmdir(os.path.dirname(self.checkpoint))
+
+    def rebuild(self, **options):
+        output = io.StringIO()
+        call_command('rebuild_thumbnails', checkpoint=self.checkpoint, stdout=output, stderr=output, **options)
+        return output.getvalue()
+
+    def test_nothing_to_rebuild(self):
+        output = self.rebuild()
+        self.assertIn('Done: scanned 3 images, rebuilt 0 images (0 thumbnails)', output)
+        self.assertEqual(Thumbnail.objects.count(), 5)
+
+    def test_rebuild_new_size(self):
+        self.basic.thumbnail_sizes.add(self.sizes[0])
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        output = self.rebuild(batch_size=2)
+        self.assertIn('Processed up to image %d' % self.images[1].pk, output)
+        self.assertIn('Done: scanned 3 images, rebuilt 3 images (3 thumbnails), 0 skipped, 0 failed', output)
+        self.assertIn('images/s', output)
+        for image in self.images:
+            thumbnail = Thumbnail.objects.get(image=image, thumbnail_size=self.sizes[0])
+            self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+            with PILImage.open('media/' + thumbnail.url.name) as stored:
+                self.assertEqual(stored.size, (200, 100))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_rebuild_from_larger_thumbnail(self):
+        self.basic.thumbnail_sizes.add(self.sizes[2])
+        self.rebuild(user='basic')
+        thumbnail = Thumbnail.objects.get(image=self.images[1], thumbnail_size=self.sizes[2])
+        with PILImage.open('media/' + thumbnail.url.name) as stored:
+            self.assertEqual(stored.size, (800, 400))
+
+    def test_rebuild_with_missing_source_file(self):
+        self.basic.thumbnail_sizes.add(self.sizes[0])
+        thumbnail = Thumbnail.objects.get(image=self.images[1])
+        os.remove('media/' + thumbnail.url.name)
+        output = self.rebuild(user='basic')
+        self.assertIn('0 thumbnails), 0 skipped, 1 failed', output)
+        self.assertIn('Failed to render %s' % self.images[1].name, output)
+        Thumbnail.objects.filter(pk=thumbnail.pk).update(url='')
+
+    def test_rebuild_without_source(self):
+        self.basic.thumbnail_sizes.add(self.sizes[0])
+        thumbnail = Thumbnail.objects.get(image=self.images[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            thumbnail.delete()
+        output = self.rebuild(user='basic')
+        self.assertIn('0 thumbnails), 1 skipped', output)
+
+    @override_settings(THUMBNAIL_RENDER_TIMEOUT=60)
+    def test_rebuild_failed_and_abandoned_thumbnails(self):
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        failed, abandoned, rendering = [
+            Thumbnail(name=Thumbnail._generate_name(image, self.sizes[0]), image=image, thumbnail_size=self.sizes[0],
+                      status=status, claimed_at=claimed_at)
+            for image, status, claimed_at in [
+                (self.images[0], Thumbnail.Status.FAILED, None),
+                (self.images[2], Thumbnail.Status.PENDING, timezone.now() - timezone.timedelta(seconds=61)),
+                (self.images[1], Thumbnail.Status.PENDING, timezone.now())]]
+        for thumbnail in [failed, abandoned, rendering]:
+            thumbnail.save()
+        self.basic.thumbnail_sizes.add(self.sizes[0])
+        output = self.rebuild()
+        self.assertIn('rebuilt 2 images (2 thumbnails), 0 skipped, 0 failed', output)
+        for thumbnail in [failed, abandoned, rendering]:
+            thumbnail.refresh_from_db()
+        self.assertEqual([failed.status, abandoned.status, rendering.status],
+                         [Thumbnail.Status.READY, Thumbnail.Status.READY, Thumbnail.Status.PENDING])
+        self.assertEqual(Thumbnail.objects.filter(thumbnail_size=self.sizes[0]).count(), 3)
+
+    @override_settings(THUMBNAIL_RENDER_TIMEOUT=60)
+    def test_rebuild_skips_thumbnails_of_queued_jobs(self):
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        queued = Thumbnail(name=Thumbnail._generate_name(self.images[0], self.sizes[0]), image=self.images[0],
+                           thumbnail_size=self.sizes[0], status=Thumbnail.Status.PENDING,
+                           claimed_at=timezone.now() - timezone.timedelta(seconds=61))
+        queued.save()
+        ThumbnailJob(image=self.images[0], source=self.images[0].url.name).save()
+        output = self.rebuild(user='user')
+        self.assertIn('rebuilt 1 images (1 thumbnails)', output)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Thumbnail.Status.PENDING)
+
+    def test_rebuild_counts_store_failures(self):
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        with mock.patch.object(Thumbnail, '_upload_thumbnail', side_effect=IntegrityError):
+            output = self.rebuild(user='user')
+        self.assertIn('0 thumbnails), 0 skipped, 2 failed', output)
+        self.assertIn('Failed to store', output)
+
+    def test_rebuild_removes_files_of_failed_stores(self):
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        stored = set(os.listdir('media/thumbnails'))
+        execute_sql = SQLInsertCompiler.execute_sql
+
+        def fail_thumbnail_insert(compiler, *args, **kwargs):
+            if compiler.query.model is not Thumbnail:
+                return execute_sql(compiler, *args, **kwargs)
+            compiler.as_sql()
+            raise IntegrityError
+
+        with mock.patch.object(SQLInsertCompiler, 'execute_sql', fail_thumbnail_insert):
+            output = self.rebuild(user='user')
+        self.assertIn('0 thumbnails), 0 skipped, 2 failed', output)
+        self.assertEqual(set(os.listdir('media/thumbnails')), stored)
+
+    def test_rebuild_reuses_duplicate_thumbnails(self):
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        rendered = Thumbnail.create_thumbnails(self.images[0], [self.sizes[0]], create_file())[0]
+        output = self.rebuild(user='user')
+        self.assertIn('rebuilt 1 images (1 thumbnails)', output)
+        self.assertEqual(Thumbnail.objects.get(image=self.images[2], thumbnail_size=self.sizes[0]).url.name,
+                         rendered.url.name)
+
+    def test_rebuild_with_filters(self):
+        self.basic.thumbnail_sizes.add(self.sizes[0])
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        self.rebuild(tier='Basic')
+        self.assertEqual(Thumbnail.objects.filter(thumbnail_size=self.sizes[0]).count(), 1)
+        self.rebuild(user='user', size=[400])
+        self.assertEqual(Thumbnail.objects.filter(thumbnail_size=self.sizes[0]).count(), 1)
+        self.rebuild(user='user', size=[100])
+        self.assertEqual(Thumbnail.objects.filter(thumbnail_size=self.sizes[0]).count(), 3)
+
+    def test_resume_from_checkpoint(self):
+        self.pro.thumbnail_sizes.add(self.sizes[0])
+        with open(self.checkpoint, 'w') as file:
+            json.dump({'filters': {'tier': None, 'user': None, 'size': []}, 'last_pk': self.images[0].pk}, file)
+        output = self.rebuild(resume=True)
+        self.assertIn('Done: scanned 2 images, rebuilt 1 images (1 thumbnails)', output)
+        self.assertFalse(Thumbnail.objects.filter(image=self.images[0], thumbnail_size=self.sizes[0]).exists())
+        self.assertTrue(Thumbnail.objects.filter(image=self.images[2], thumbnail_size=self.sizes[0]).exists())
+
+    def test_resume_with_different_filters(self):
+        with open(self.checkpoint, 'w') as file:
+            json.dump({'filters': {'tier': 'Pro', 'user': None, 'size': []}, 'last_pk': self.images[0].pk}, file)
+        self.assertRaises(CommandError, self.rebuild, resume=True)
+        os.remove(self.checkpoint)
+
+
+class RebuildThumbnailsProcessPoolTestCase(TransactionTestCase):
+    def test_rebuild_on_process_pool(self):
+        sizes = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200]]
+        tier = AccountTierClass.get_or_create_validated(name='Pro', thumbnail_sizes=sizes, original_image=True)
+        user = User(username='user', password='password')
+        user.save()
+        AccountTier.add_user_to_account_tier(tier, user)
+        for _ in range(4):
+            Image.create_image(user, create_file())
+        output = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(THUMBNAIL_PARALLEL=True, THUMBNAIL_POOL_SIZE=2):
+                call_command('rebuild_thumbnails', checkpoint=os.path.join(directory, 'checkpoint.json'),
+                             stdout=output)
+            shutdown_pool()
+        self.assertIn('rebuilt 4 images (8 thumbnails)', output.getvalue())
+        self.assertEqual(Thumbnail.objects.filter(status=Thumbnail.Status.READY).count(), 8)
+        remove_media()
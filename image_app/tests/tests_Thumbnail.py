@@ -1,10 +1,11 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from django.core.files import File
+from unittest import mock
 from PIL import Image as PILImage
 import io
 import os
-from ..models import Thumbnail, Image, AccountTier, AccountTierClass, ThumbnailSize
+from ..models import Thumbnail, Image, AccountTier, AccountTierClass, ThumbnailSize, EncodingProfile
 
 
 class ThumbnailTestCase(TestCase):
@@ -93,6 +94,116 @@ class ThumbnailTestCase(TestCase):
             self.assertRaises(TypeError, Thumbnail.create_thumbnail, self.image, self.thumbnails[0], value)
         self.assertEqual(Thumbnail.objects.count(), 0)
 
+    def test_create_thumbnails(self):
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails, file=self.file)
+        self.assertEqual([thumbnail.thumbnail_size.height for thumbnail in thumbnails], [800, 400, 200, 100])
+        self.assertEqual(Thumbnail.objects.filter(image=self.image).count(), 4)
+        for thumbnail in thumbnails:
+            with PILImage.open('media/' + thumbnail.url.name) as stored:
+                self.assertEqual(stored.size, (thumbnail.thumbnail_size.height, thumbnail.thumbnail_size.height))
+            os.remove('media/' + thumbnail.url.name)
+
+    @override_settings(THUMBNAIL_RENDITION_FORMATS=['webp', 'avif'])
+    def test_create_thumbnails_with_renditions(self):
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails[:2], file=self.file)
+        for thumbnail in thumbnails:
+            self.assertEqual(thumbnail.webp.name, 'thumbnails/' + thumbnail.name[:-3] + 'webp')
+            self.assertEqual(thumbnail.avif.name, 'thumbnails/' + thumbnail.name[:-3] + 'avif')
+            for field_file, format in [(thumbnail.url, 'JPEG'), (thumbnail.webp, 'WEBP'), (thumbnail.avif, 'AVIF')]:
+                with PILImage.open('media/' + field_file.name) as stored:
+                    self.assertEqual(stored.format, format)
+                    self.assertEqual(stored.size, (thumbnail.thumbnail_size.height, thumbnail.thumbnail_size.height))
+                os.remove('media/' + field_file.name)
+        self.assertEqual(thumbnails[0].rendition(['webp', 'avif']), (thumbnails[0].avif, 'image/avif'))
+        self.assertEqual(thumbnails[0].rendition(['webp']), (thumbnails[0].webp, 'image/webp'))
+        self.assertEqual(thumbnails[0].rendition([]), (thumbnails[0].url, 'image/jpeg'))
+
+    @override_settings(THUMBNAIL_RENDITION_FORMATS=['webp'])
+    def test_create_thumbnails_for_duplicate_image_reuses_renditions(self):
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        duplicate = Image.create_image(self.user, self.file)
+        duplicates = Thumbnail.create_thumbnails(image=duplicate, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        self.assertEqual(duplicates[0].webp.name, thumbnails[0].webp.name)
+        os.remove('media/' + thumbnails[0].url.name)
+        os.remove('media/' + thumbnails[0].webp.name)
+
+    def test_create_thumbnails_for_duplicate_image(self):
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails[:2], file=self.file)
+        duplicate = Image.create_image(self.user, self.file)
+        with mock.patch('image_app.models.render_thumbnails') as render:
+            duplicates = Thumbnail.create_thumbnails(image=duplicate, thumbnail_sizes=self.thumbnails[:2],
+                                                     file=self.file)
+        render.assert_not_called()
+        self.assertEqual([thumbnail.url.name for thumbnail in duplicates],
+                         [thumbnail.url.name for thumbnail in thumbnails])
+        self.assertEqual([thumbnail.status for thumbnail in duplicates], [Thumbnail.Status.READY] * 2)
+        self.assertNotEqual(duplicates[0].name, thumbnails[0].name)
+        for thumbnail in thumbnails:
+            os.remove('media/' + thumbnail.url.name)
+
+    def test_create_thumbnails_for_other_users_duplicate_image(self):
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        other_user = User.objects.create(username='Other', password='Password')
+        AccountTier.add_user_to_account_tier(tier=self.tier_class, user=other_user)
+        duplicate = Image.create_image(other_user, self.file)
+        duplicates = Thumbnail.create_thumbnails(image=duplicate, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        self.assertEqual(duplicates[0].url.name, 'thumbnails/' + duplicates[0].name)
+        for thumbnail in [thumbnails[0], duplicates[0]]:
+            os.remove('media/' + thumbnail.url.name)
+
+    def test_create_thumbnails_for_duplicate_image_with_other_encoding_profile(self):
+        low = EncodingProfile.objects.create(name='Low', quality=5)
+        self.tier_class.encoding_profile = low
+        self.tier_class.save()
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        high_tier = AccountTierClass.get_or_create_validated(name='Premium', thumbnail_sizes=self.thumbnails[:1])
+        high_tier.encoding_profile = EncodingProfile.objects.create(name='High', quality=95)
+        high_tier.save()
+        other_user = User.objects.create(username='Other', password='Password')
+        AccountTier.add_user_to_account_tier(tier=high_tier, user=other_user)
+        duplicate = Image.create_image(other_user, self.file)
+        duplicates = Thumbnail.create_thumbnails(image=duplicate, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        self.assertNotEqual(duplicates[0].url.name, thumbnails[0].url.name)
+        self.assertEqual(duplicates[0].encoding, high_tier.encoding_profile.fingerprint())
+        self.assertGreater(duplicates[0].url.size, thumbnails[0].url.size)
+        os.remove('media/' + duplicates[0].url.name)
+        low.quality = 95
+        low.save()
+        again = Image.create_image(self.user, self.file)
+        reused = Thumbnail.create_thumbnails(image=again, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        self.assertNotEqual(reused[0].url.name, thumbnails[0].url.name)
+        for thumbnail in [thumbnails[0], reused[0]]:
+            os.remove('media/' + thumbnail.url.name)
+
+    def test_create_thumbnails_for_duplicate_image_renders_missing_sizes(self):
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=self.thumbnails[:1], file=self.file)
+        duplicate = Image.create_image(self.user, self.file)
+        duplicates = Thumbnail.create_thumbnails(image=duplicate, thumbnail_sizes=self.thumbnails[:2], file=self.file)
+        self.assertEqual(duplicates[1].url.name, thumbnails[0].url.name)
+        self.assertEqual(duplicates[0].url.name, 'thumbnails/' + duplicates[0].name)
+        os.remove('media/' + thumbnails[0].url.name)
+        os.remove('media/' + duplicates[0].url.name)
+
+    def test_create_thumbnails_larger_than_source(self):
+        size = ThumbnailSize.get_or_create_validated(2000)
+        self.tier_class.thumbnail_sizes.add(size)
+        thumbnails = Thumbnail.create_thumbnails(image=self.image, thumbnail_sizes=[size, self.thumbnails[0]],
+                                                 file=self.file)
+        self.assertEqual([thumbnail.thumbnail_size.height for thumbnail in thumbnails], [2000, 100])
+        for thumbnail in thumbnails:
+            os.remove('media/' + thumbnail.url.name)
+
+    def test_create_thumbnails_with_thumbnail_size_that_is_not_in_users_account_tier(self):
+        self.tier_class.thumbnail_sizes.remove(self.thumbnails[0])
+        self.assertRaises(ValueError, Thumbnail.create_thumbnails, self.image, self.thumbnails, self.file)
+        self.assertEqual(Thumbnail.objects.count(), 0)
+
+    def test_create_thumbnails_with_not_thumbnail_size_as_thumbnail_size(self):
+        values = ['', ' ', '1', 1, 1.1, True, False, None, list(), tuple(), dict(), set()]
+        for value in values:
+            self.assertRaises(TypeError, Thumbnail.create_thumbnails, self.image, [value], self.file)
+        self.assertEqual(Thumbnail.objects.count(), 0)
+
     def test_in_order(self):
         self.Test_create_thumbnail()
         self.tearDown()
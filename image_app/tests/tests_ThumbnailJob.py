@@ -0,0 +1,83 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management import call_command
+from django.utils import timezone
+from PIL import Image as PILImage
+import io
+import os
+from ..models import Thumbnail, ThumbnailJob, Image, AccountTier, AccountTierClass, ThumbnailSize
+
+
+class ThumbnailJobTestCase(TestCase):
+    def setUp(self):
+        self.thumbnails = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200]]
+        self.tier_class = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=self.thumbnails)
+        self.user = User(username='User', password='Password')
+        self.user.save()
+        self.account_tier = AccountTier.add_user_to_account_tier(tier=self.tier_class, user=self.user)
+        img = PILImage.new('RGB', (1000, 1000), color='red')
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='jpeg')
+        self.file = File(img_bytes, name='uploaded_file.jpg')
+        self.image = Image.create_image(self.user, self.file)
+
+    def test_enqueue(self):
+        job = ThumbnailJob.enqueue(self.image, self.thumbnails, self.file)
+        self.assertEqual(job.status, ThumbnailJob.Status.QUEUED)
+        self.assertEqual(job.source.name, 'jobs/' + self.image.name)
+        self.assertEqual(Thumbnail.objects.filter(image=self.image, status=Thumbnail.Status.PENDING).count(), 2)
+        os.remove('media/' + job.source.name)
+
+    def test_enqueue_with_thumbnail_size_that_is_not_in_users_account_tier(self):
+        self.tier_class.thumbnail_sizes.remove(self.thumbnails[0])
+        self.assertRaises(ValueError, ThumbnailJob.enqueue, self.image, self.thumbnails, self.file)
+        self.assertEqual(Thumbnail.objects.count(), 0)
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+
+    def test_claim_and_run(self):
+        job = ThumbnailJob.enqueue(self.image, self.thumbnails, self.file)
+        source = job.source.name
+        claimed = ThumbnailJob.claim('worker')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, ThumbnailJob.Status.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(ThumbnailJob.claim('worker'))
+        self.assertTrue(claimed.run())
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+        self.assertFalse(os.path.exists('media/' + source))
+        for thumbnail in Thumbnail.objects.filter(image=self.image):
+            self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+            os.remove('media/' + thumbnail.url.name)
+
+    @override_settings(THUMBNAIL_JOB_MAX_ATTEMPTS=2)
+    def test_run_with_broken_source(self):
+        job = ThumbnailJob.enqueue(self.image, self.thumbnails, File(io.BytesIO(b'broken'), name='broken.jpg'))
+        self.assertFalse(ThumbnailJob.claim('worker').run())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.Status.QUEUED)
+        self.assertFalse(ThumbnailJob.claim('worker').run())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.Status.FAILED)
+        self.assertNotEqual(job.error, '')
+        self.assertEqual(Thumbnail.objects.filter(image=self.image, status=Thumbnail.Status.FAILED).count(), 2)
+        self.assertFalse(os.path.exists('media/' + job.source.name))
+
+    def test_requeue_stale(self):
+        job = ThumbnailJob.enqueue(self.image, self.thumbnails, self.file)
+        ThumbnailJob.claim('worker')
+        self.assertEqual(ThumbnailJob.requeue_stale(60), 0)
+        ThumbnailJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timezone.timedelta(seconds=120))
+        self.assertEqual(ThumbnailJob.requeue_stale(60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.Status.QUEUED)
+        os.remove('media/' + job.source.name)
+
+    def test_run_thumbnail_workers_command(self):
+        ThumbnailJob.enqueue(self.image, self.thumbnails, self.file)
+        output = io.StringIO()
+        call_command('run_thumbnail_workers', workers=0, burst=True, stdout=output)
+        self.assertIn('Processed 1 jobs', output.getvalue())
+        for thumbnail in Thumbnail.objects.filter(image=self.image):
+            self.assertEqual(thumbnail.status, Thumbnail.Status.READY)
+            os.remove('media/' + thumbnail.url.name)
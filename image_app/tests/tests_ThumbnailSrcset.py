@@ -0,0 +1,63 @@
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.test import override_settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image as PILImage
+import io
+import os
+from ..views import ThumbnailSrcset
+from ..models import ThumbnailSize, AccountTierClass, AccountTier, Image, Thumbnail
+
+
+def create_image():
+    img = PILImage.new('RGB', (1000, 500), color='red')
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='jpeg')
+    return SimpleUploadedFile('uploaded_file.jpg', img_bytes.getvalue(), content_type='image/jpeg')
+
+
+class ThumbnailSrcsetTestCase(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = ThumbnailSrcset.as_view()
+        self.user = User(username='test', password='test')
+        self.user.save()
+        self.thumbnail_sizes = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200]]
+        tier = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=self.thumbnail_sizes)
+        AccountTier.add_user_to_account_tier(tier, self.user)
+
+    def get(self, image_name, user=None):
+        request = self.factory.get('images/' + image_name + '/thumbnails/')
+        force_authenticate(request, user or self.user)
+        request.user = user or self.user
+        return self.view(request, image_name=image_name)
+
+    @override_settings(THUMBNAIL_RENDITION_FORMATS=['webp'])
+    def test_srcset(self):
+        file = create_image()
+        image = Image.create_image(self.user, file)
+        thumbnails = Thumbnail.create_thumbnails(image, self.thumbnail_sizes, file)
+        response = self.get(image.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], image.name)
+        self.assertEqual(sorted(response.data['srcset']), ['image/jpeg', 'image/webp'])
+        small, large = response.data['srcset']['image/webp'].split(', ')
+        self.assertTrue(small.endswith('/images/%s/thumbnails/100?rendition=webp&v=%s 200w'
+                                       % (image.name, thumbnails[1].version)))
+        self.assertTrue(large.endswith('/images/%s/thumbnails/200?rendition=webp&v=%s 400w'
+                                       % (image.name, thumbnails[0].version)))
+        for thumbnail in thumbnails:
+            os.remove('media/' + thumbnail.url.name)
+            os.remove('media/' + thumbnail.webp.name)
+
+    def test_srcset_skips_pending_thumbnails(self):
+        image = Image.create_image(self.user, create_image())
+        Thumbnail._create_pending(image, self.thumbnail_sizes)
+        response = self.get(image.name)
+        self.assertEqual(response.data['srcset'], {})
+
+    def test_srcset_of_other_user_image(self):
+        image = Image.create_image(self.user, create_image())
+        user = User(username='test1', password='test1')
+        user.save()
+        self.assertEqual(self.get(image.name, user).status_code, 404)
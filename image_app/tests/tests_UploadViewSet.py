@@ -1,11 +1,17 @@
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+from django.test import TransactionTestCase, override_settings
+from django.db import connection
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from django.contrib.auth.models import User, AnonymousUser
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
 from PIL import Image as PILImage
+import hashlib
 import io
 import os
 from ..views import UploadViewSet
-from ..models import ThumbnailSize, AccountTierClass, AccountTier, Thumbnail, Image
+from ..models import ThumbnailSize, AccountTierClass, AccountTier, Thumbnail, ThumbnailJob, Image
 
 
 class UploadViewSetTestCase(APITestCase):
@@ -42,6 +48,7 @@ class UploadViewSetTestCase(APITestCase):
         self.assertEqual(response.data['name'], image.name)
         self.assertEqual(response.data['thumbnails'][0]['name'], thumbnail.name)
         self.assertEqual(response.data['thumbnails'][0]['size'], '200px')
+        self.assertEqual(response.data['thumbnails'][0]['status'], 'ready')
         os.remove('media/' + thumbnail.url.name)
 
     def test_upload_image_with_original_image(self):
@@ -65,6 +72,140 @@ class UploadViewSetTestCase(APITestCase):
         os.remove('media/' + thumbnail[1].url.name)
         os.remove('media/' + image.url.name)
 
+    def test_upload_image_is_hashed_and_moved_to_storage(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[1], self.user)
+        content = self.file.read()
+        self.file.seek(0)
+        request = self.factory.post('upload/', {'file_uploaded': self.file})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        self.view(request)
+        image = Image.objects.get()
+        self.assertEqual(image.content_hash, hashlib.blake2b(content, digest_size=32).hexdigest())
+        with open('media/' + image.url.name, 'rb') as stored:
+            self.assertEqual(stored.read(), content)
+        self.assertEqual(os.listdir(settings.FILE_UPLOAD_TEMP_DIR), [])
+        for thumbnail in Thumbnail.objects.all():
+            os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_upload_image_with_async_thumbnails(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[1], self.user)
+        request = self.factory.post('upload/', {'file_uploaded': self.file})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Thumbnail.objects.filter(status=Thumbnail.Status.PENDING).count(), 2)
+        self.assertEqual(response.data['thumbnails'][0]['status'], 'pending')
+        self.assertNotIn('url', response.data['thumbnails'][0])
+        job = ThumbnailJob.objects.get()
+        image = Image.objects.get(pk=1)
+        self.assertEqual(job.source.name, image.url.name)
+        self.assertTrue(ThumbnailJob.claim('worker').run())
+        thumbnail = Thumbnail.objects.all()
+        self.assertEqual(thumbnail[0].status, Thumbnail.Status.READY)
+        self.assertEqual(thumbnail[1].status, Thumbnail.Status.READY)
+        os.remove('media/' + thumbnail[0].url.name)
+        os.remove('media/' + thumbnail[1].url.name)
+        os.remove('media/' + image.url.name)
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_upload_duplicate_image(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[1], self.user)
+        content = self.file.read()
+        responses = []
+        for _ in range(2):
+            request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(
+                'uploaded_file.jpg', content, content_type='image/jpeg')})
+            force_authenticate(request, self.user)
+            request.user = self.user
+            responses.append(self.view(request))
+            if ThumbnailJob.objects.exists():
+                self.assertTrue(ThumbnailJob.claim('worker').run())
+        self.assertEqual(responses[1].status_code, 201)
+        self.assertEqual([thumbnail['status'] for thumbnail in responses[1].data['thumbnails']], ['ready', 'ready'])
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+        image, duplicate = Image.objects.order_by('pk')
+        self.assertEqual(duplicate.url.name, image.url.name)
+        self.assertEqual(Thumbnail.objects.values('url').distinct().count(), 2)
+        for thumbnail in image.thumbnail_set.all():
+            os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    def test_failed_upload_rolls_back_rows_and_files(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[1], self.user)
+        request = self.factory.post('upload/', {'file_uploaded': self.file})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        with mock.patch('image_app.models.render_thumbnails', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, self.view, request)
+        self.assertEqual(Image.objects.count(), 0)
+        self.assertEqual(Thumbnail.objects.count(), 0)
+        self.assertEqual(os.listdir('media/images'), [])
+        self.assertEqual(os.listdir('media/thumbnails'), [])
+
+    def test_failed_duplicate_upload_keeps_shared_files(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[1], self.user)
+        content = self.file.read()
+        request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(
+            'uploaded_file.jpg', content, content_type='image/jpeg')})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        self.view(request)
+        image = Image.objects.get()
+        request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(
+            'uploaded_file.jpg', content, content_type='image/jpeg')})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        with mock.patch('image_app.models.Thumbnail._reuse_duplicates', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, self.view, request)
+        self.assertEqual(list(Image.objects.all()), [image])
+        self.assertTrue(os.path.exists('media/' + image.url.name))
+        for thumbnail in image.thumbnail_set.all():
+            self.assertTrue(os.path.exists('media/' + thumbnail.url.name))
+            os.remove('media/' + thumbnail.url.name)
+        os.remove('media/' + image.url.name)
+
+    def test_upload_image_over_account_tier_pixel_budget(self):
+        self.account_tier_classes[0].max_pixels = 999999
+        self.account_tier_classes[0].save()
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
+        request = self.factory.post('upload/', {'file_uploaded': self.file})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.data['message'], 'Image is too large')
+        self.assertEqual(Image.objects.count(), 0)
+        self.assertEqual(Thumbnail.objects.count(), 0)
+
+    @override_settings(THUMBNAIL_MAX_DECODE_PIXELS=999999)
+    def test_upload_png_image_over_decode_budget(self):
+        img = PILImage.new('RGB', (1000, 1000), color='red')
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='png')
+        file = SimpleUploadedFile('uploaded_file.png', img_bytes.getvalue(), content_type='image/png')
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
+        request = self.factory.post('upload/', {'file_uploaded': file})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Image.objects.count(), 0)
+
+    @override_settings(THUMBNAIL_MAX_DECODE_PIXELS=999999)
+    def test_upload_jpeg_image_over_decode_budget(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
+        request = self.factory.post('upload/', {'file_uploaded': self.file})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 201)
+        thumbnail = Thumbnail.objects.get()
+        os.remove('media/' + thumbnail.url.name)
+
     def test_create_without_file(self):
         AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
         request = self.factory.post('upload/')
@@ -126,9 +267,11 @@ class UploadViewSetTestCase(APITestCase):
         os.remove('media/' + thumbnail.url.name)
 
     def test_upload_png_image(self):
-        self.file.name = 'uploaded_file.png'
+        img_bytes = io.BytesIO()
+        PILImage.new('RGB', (1000, 1000), color='red').save(img_bytes, format='png')
+        file = SimpleUploadedFile('uploaded_file.png', img_bytes.getvalue(), content_type='image/png')
         AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
-        request = self.factory.post('upload/', {'file_uploaded': self.file})
+        request = self.factory.post('upload/', {'file_uploaded': file})
         force_authenticate(request, self.user)
         request.user = self.user
         response = self.view(request)
@@ -143,6 +286,57 @@ class UploadViewSetTestCase(APITestCase):
         self.assertEqual(response.data['thumbnails'][0]['size'], '200px')
         os.remove('media/' + thumbnail.url.name)
 
+    def test_upload_mislabelled_image(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
+        content = self.file.read()
+        for name, content_type in [('uploaded_file.png', 'image/jpeg'), ('uploaded_file.jpg', 'image/png'),
+                                   ('uploaded_file.png', 'image/png')]:
+            request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(name, content, content_type)})
+            force_authenticate(request, self.user)
+            request.user = self.user
+            response = self.view(request)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(response.data['message'],
+                             'File is corrupt or does not match its media type and extension')
+        self.assertEqual(Image.objects.count(), 0)
+
+    def test_upload_corrupt_image(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
+        content = self.file.read()
+        for corrupt in [b'', b'not an image', content[:20]]:
+            request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(
+                'uploaded_file.jpg', corrupt, content_type='image/jpeg')})
+            force_authenticate(request, self.user)
+            request.user = self.user
+            with mock.patch('image_app.views.Image.create_image') as create_image:
+                response = self.view(request)
+            self.assertEqual(response.status_code, 422)
+            create_image.assert_not_called()
+        self.assertEqual(os.listdir('media/images'), [])
+
+    def test_upload_truncated_image(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[1], self.user)
+        content = self.file.read()
+        request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(
+            'uploaded_file.jpg', content[:len(content) // 2], content_type='image/jpeg')})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['message'], 'File is corrupt or does not match its media type and extension')
+        self.assertEqual(Image.objects.count(), 0)
+        self.assertEqual(os.listdir('media/images'), [])
+
+    def test_upload_image_with_trailing_data(self):
+        AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
+        request = self.factory.post('upload/', {'file_uploaded': SimpleUploadedFile(
+            'uploaded_file.jpg', self.file.read() + b'ftypmp42' + bytes(4096), content_type='image/jpeg')})
+        force_authenticate(request, self.user)
+        request.user = self.user
+        response = self.view(request)
+        self.assertEqual(response.status_code, 201)
+        os.remove('media/' + Thumbnail.objects.get().url.name)
+
     def test_upload_image_with_no_png_or_jpg_extension(self):
         self.file.name = 'uploaded_file.jpeg'
         AccountTier.add_user_to_account_tier(self.account_tier_classes[0], self.user)
@@ -186,3 +380,37 @@ class UploadViewSetTestCase(APITestCase):
         self.assertEqual(Image.objects.filter(owner=self.user).count(), 0)
         self.assertEqual(Thumbnail.objects.count(), 0)
         self.assertEqual(Thumbnail.objects.filter(image__owner=self.user).count(), 0)
+
+
+class ConcurrentUploadTestCase(TransactionTestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = UploadViewSet.as_view({'post': 'create'})
+        self.user = User(username='test', password='test')
+        self.user.save()
+        thumbnail_size = ThumbnailSize.get_or_create_validated(20)
+        tier = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=[thumbnail_size])
+        AccountTier.add_user_to_account_tier(tier, self.user)
+        img = PILImage.new('RGB', (50, 50), color='red')
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='jpeg')
+        self.content = img_bytes.getvalue()
+
+    def upload(self, index):
+        try:
+            file = SimpleUploadedFile('uploaded_file.jpg', self.content, content_type='image/jpeg')
+            request = self.factory.post('upload/', {'file_uploaded': file})
+            force_authenticate(request, self.user)
+            request.user = self.user
+            return self.view(request).status_code
+        finally:
+            connection.close()
+
+    def test_parallel_uploads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(self.upload, range(200)))
+        self.assertEqual(statuses, [201] * 200)
+        self.assertEqual(Image.objects.count(), 200)
+        self.assertEqual(Image.objects.values('name').distinct().count(), 200)
+        for name in set(Thumbnail.objects.values_list('url', flat=True)):
+            os.remove('media/' + name)
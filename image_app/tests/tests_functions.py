@@ -0,0 +1,355 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from unittest import mock
+from multiprocessing import shared_memory
+from PIL import Image as PILImage
+import hashlib
+import io
+import os
+import tempfile
+import time
+from ..functions import open_image, resize_thumbnail, build_pyramid, render_thumbnails, shutdown_pool, get_pool, \
+    resize_buffer, render_batch, generate_unique_id, ID_LENGTH, inspect_image, fits_decode_budget, ImageTooLarge, \
+    content_hash, encode_photo, encode_image, save_options, resize_image, RESAMPLING_FILTERS, sniff_image, InvalidImage
+from .. import functions
+from ..models import Thumbnail, Image, AccountTier, AccountTierClass, ThumbnailSize, EncodingProfile
+
+
+def create_image(size, format='jpeg'):
+    img = PILImage.new('RGB', size, color='red')
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format=format)
+    return img_bytes
+
+
+class GenerateUniqueIdTestCase(TestCase):
+    def test_generate_unique_id(self):
+        ids = [generate_unique_id() for _ in range(10000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(len(unique_id) == ID_LENGTH for unique_id in ids))
+
+    def test_generate_unique_id_is_time_ordered(self):
+        first = generate_unique_id()
+        time.sleep(0.002)
+        self.assertLess(first, generate_unique_id())
+
+
+class DecodeStrategyTestCase(TestCase):
+    def test_open_image_with_draft_strategy(self):
+        image = open_image(create_image((3000, 2000)), 200, 'draft')
+        self.assertEqual(image.size, (375, 250))
+
+    def test_open_image_with_full_strategy(self):
+        image = open_image(create_image((3000, 2000)), 200, 'full')
+        self.assertEqual(image.size, (3000, 2000))
+
+    def test_open_png_image_with_draft_strategy(self):
+        image = open_image(create_image((3000, 2000), format='png'), 200, 'draft')
+        self.assertEqual(image.size, (3000, 2000))
+
+    def test_open_image_with_not_valid_strategy(self):
+        self.assertRaises(ValueError, open_image, create_image((100, 100)), 50, 'fast')
+
+    def test_resize_thumbnail_with_both_strategies(self):
+        file = create_image((3000, 2000))
+        self.assertEqual(resize_thumbnail(file, 200, 'full').size, resize_thumbnail(file, 200, 'draft').size)
+
+    @override_settings(THUMBNAIL_DECODE_STRATEGY='full')
+    def test_build_pyramid_with_full_strategy_setting(self):
+        pyramid = build_pyramid(create_image((3000, 2000)), [400, 200])
+        self.assertEqual(pyramid[400].size, (600, 400))
+        self.assertEqual(pyramid[200].size, (300, 200))
+
+    def test_benchmark_decode(self):
+        output = io.StringIO()
+        call_command('benchmark_thumbnails', 'decode', sources=[400], repeat=1, stdout=output)
+        self.assertIn('400px', output.getvalue())
+
+
+class ResamplingTestCase(TestCase):
+    def setUp(self):
+        self.image = PILImage.effect_mandelbrot((1500, 1000), (-2.0, -1.0, 1.0, 1.0), 100).convert('RGB')
+
+    def test_resize_image_with_every_filter(self):
+        for name in RESAMPLING_FILTERS:
+            for gap in [None, 2.0]:
+                self.assertEqual(resize_image(self.image, 100, name, gap).size, (150, 100))
+
+    def test_resize_image_with_not_valid_filter(self):
+        self.assertRaises(ValueError, resize_image, self.image, 100, 'cubic')
+
+    @override_settings(THUMBNAIL_RESAMPLING='nearest', THUMBNAIL_REDUCING_GAP=None)
+    def test_resize_image_uses_settings(self):
+        with mock.patch.object(self.image, 'resize', wraps=self.image.resize) as resize:
+            resize_image(self.image, 100)
+        resize.assert_called_once_with((150, 100), PILImage.NEAREST, reducing_gap=None)
+
+    def test_reducing_gap_stays_close_to_full_resample(self):
+        full = resize_image(self.image, 100, 'lanczos')
+        reduced = resize_image(self.image, 100, 'lanczos', 3.0)
+        difference = [abs(a - b) for a, b in zip(full.convert('L').getdata(), reduced.convert('L').getdata())]
+        self.assertLess(sum(difference) / len(difference), 8)
+
+    def test_benchmark_resample(self):
+        output = io.StringIO()
+        call_command('benchmark_thumbnails', 'resample', sources=[400], repeat=1, filters=['nearest', 'lanczos'],
+                     stdout=output)
+        self.assertIn('lanczos', output.getvalue())
+        self.assertIn('400px', output.getvalue())
+
+
+class EncodingProfileTestCase(TestCase):
+    def setUp(self):
+        self.image = PILImage.effect_mandelbrot((300, 200), (-2.0, -1.0, 1.0, 1.0), 100).convert('RGB')
+
+    def test_save_options_without_profile(self):
+        self.assertEqual(save_options(None, 'jpeg'), {})
+
+    def test_encode_jpeg_with_profile(self):
+        fast = EncodingProfile(name='Fast', quality=40)
+        progressive = EncodingProfile(name='Progressive', quality=90, progressive=True, optimize=True,
+                                      subsampling=EncodingProfile.Subsampling.YUV444)
+        content = encode_image(self.image, 'jpeg', save_options(progressive, 'jpeg'))
+        with PILImage.open(io.BytesIO(content)) as stored:
+            self.assertTrue(stored.info.get('progressive'))
+        self.assertLess(len(encode_image(self.image, 'jpeg', save_options(fast, 'jpeg'))), len(content))
+
+    def test_encode_png_with_profile(self):
+        fast = encode_image(self.image, 'png', save_options(EncodingProfile(compress_level=0), 'png'))
+        small = encode_image(self.image, 'png', save_options(EncodingProfile(compress_level=9), 'png'))
+        self.assertLess(len(small), len(fast))
+
+    def test_create_thumbnails_with_tier_profile(self):
+        thumbnail_size = ThumbnailSize.get_or_create_validated(100)
+        tier_class = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=[thumbnail_size])
+        tier_class.encoding_profile = EncodingProfile.objects.create(name='Progressive', progressive=True)
+        tier_class.save()
+        user = User(username='User', password='Password')
+        user.save()
+        AccountTier.add_user_to_account_tier(tier=tier_class, user=user)
+        file = File(create_image((300, 200)), name='uploaded_file.jpg')
+        thumbnail, = Thumbnail.create_thumbnails(Image.create_image(user, file), [thumbnail_size], file)
+        with PILImage.open('media/' + thumbnail.url.name) as stored:
+            self.assertTrue(stored.info.get('progressive'))
+        os.remove('media/' + thumbnail.url.name)
+
+    def test_benchmark_encode(self):
+        EncodingProfile.objects.create(name='Fast', quality=40)
+        output = io.StringIO()
+        call_command('benchmark_thumbnails', 'encode', sources=[400], repeat=1, stdout=output)
+        self.assertIn('default', output.getvalue())
+        self.assertIn('Fast', output.getvalue())
+
+
+class StreamingTestCase(TestCase):
+    def test_content_hash(self):
+        content = create_image((100, 100)).getvalue()
+        file = SimpleUploadedFile('uploaded_file.jpg', content)
+        self.assertEqual(content_hash(file), hashlib.blake2b(content, digest_size=32).hexdigest())
+        self.assertEqual(file.tell(), 0)
+
+    def test_content_hash_computed_while_streaming(self):
+        file = SimpleUploadedFile('uploaded_file.jpg', b'content')
+        file.content_hash = 'precomputed'
+        self.assertEqual(content_hash(file), 'precomputed')
+
+    def test_open_image_from_mapped_file(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(create_image((3000, 2000)).getvalue())
+            self.assertEqual(inspect_image(file), ('JPEG', (3000, 2000), 'RGB'))
+            self.assertEqual(open_image(file, 200, 'draft').size, (375, 250))
+
+    def test_open_empty_file(self):
+        with tempfile.TemporaryFile() as file:
+            self.assertRaises(PILImage.UnidentifiedImageError, open_image, file)
+
+    def test_encode_photo_is_staged_on_disk(self):
+        photo = Thumbnail(name='photo_200.jpg')
+        file = encode_photo(PILImage.new('RGB', (200, 200), color='red'), photo)
+        path = file.temporary_file_path()
+        self.assertEqual(os.path.dirname(path), settings.FILE_UPLOAD_TEMP_DIR)
+        with PILImage.open(file) as stored:
+            self.assertEqual(stored.format, 'JPEG')
+        file.close()
+        self.assertFalse(os.path.exists(path))
+
+
+class SniffImageTestCase(TestCase):
+    def test_sniff_jpeg(self):
+        self.assertEqual(sniff_image(create_image((300, 200))), ('JPEG', (300, 200)))
+
+    def test_sniff_png(self):
+        self.assertEqual(sniff_image(create_image((300, 200), format='png')), ('PNG', (300, 200)))
+
+    def test_sniff_progressive_jpeg_with_exif(self):
+        img_bytes = io.BytesIO()
+        exif = PILImage.Exif()
+        exif[0x010e] = 'description' * 1000
+        PILImage.new('RGB', (300, 200)).save(img_bytes, format='jpeg', progressive=True, exif=exif)
+        self.assertEqual(sniff_image(img_bytes), ('JPEG', (300, 200)))
+
+    def test_sniff_mapped_file(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(create_image((300, 200)).getvalue())
+            self.assertEqual(sniff_image(file), ('JPEG', (300, 200)))
+
+    def test_sniff_invalid_image(self):
+        content = create_image((300, 200)).getvalue()
+        png = create_image((300, 200), format='png').getvalue()
+        for value in [b'', b'GIF89a', content[:3], content[:100], png[:30], png[:-20]]:
+            self.assertRaises(InvalidImage, sniff_image, io.BytesIO(value))
+
+    def test_sniff_jpeg_with_trailing_data(self):
+        content = create_image((300, 200)).getvalue() + bytes(4096)
+        self.assertEqual(sniff_image(io.BytesIO(content)), ('JPEG', (300, 200)))
+        self.assertEqual(open_image(io.BytesIO(content)).size, (300, 200))
+
+    def test_open_truncated_image(self):
+        content = create_image((300, 200)).getvalue()
+        self.assertRaises(InvalidImage, open_image, io.BytesIO(content[:len(content) // 2]))
+
+
+@override_settings(THUMBNAIL_MAX_DECODE_PIXELS=1000000)
+class DecodeBudgetTestCase(TestCase):
+    def test_inspect_image(self):
+        self.assertEqual(inspect_image(create_image((3000, 2000))), ('JPEG', (3000, 2000), 'RGB'))
+        self.assertEqual(inspect_image(create_image((30, 20), format='png')), ('PNG', (30, 20), 'RGB'))
+
+    def test_inspect_decompression_bomb(self):
+        with mock.patch.object(PILImage, 'MAX_IMAGE_PIXELS', 1000):
+            self.assertRaises(ImageTooLarge, inspect_image, create_image((100, 100), format='png'))
+
+    def test_fits_decode_budget(self):
+        self.assertTrue(fits_decode_budget('PNG', 1000, 1000))
+        self.assertFalse(fits_decode_budget('PNG', 1001, 1000))
+        self.assertTrue(fits_decode_budget('JPEG', 8000, 8000))
+        self.assertFalse(fits_decode_budget('JPEG', 8008, 8000))
+
+    def test_open_large_jpeg_is_reduced_to_budget(self):
+        image = open_image(create_image((3000, 2000)), strategy='full')
+        self.assertEqual(image.size, (750, 500))
+
+    def test_open_large_jpeg_with_draft_strategy(self):
+        image = open_image(create_image((3000, 2000)), 100, 'draft')
+        self.assertEqual(image.size, (375, 250))
+        image = open_image(create_image((3000, 2000)), 800, 'draft')
+        self.assertEqual(image.size, (750, 500))
+
+    def test_open_large_png(self):
+        self.assertRaises(ImageTooLarge, open_image, create_image((1500, 1000), format='png'), 100)
+        self.assertEqual(open_image(create_image((1000, 1000), format='png'), 100).size, (1000, 1000))
+
+
+@override_settings(THUMBNAIL_PARALLEL=True, THUMBNAIL_POOL_SIZE=2)
+class ParallelRenderTestCase(TestCase):
+    def setUp(self):
+        self.thumbnails = [ThumbnailSize.get_or_create_validated(size) for size in [100, 200, 400]]
+        self.tier_class = AccountTierClass.get_or_create_validated(name='Basic', thumbnail_sizes=self.thumbnails)
+        self.user = User(username='User', password='Password')
+        self.user.save()
+        AccountTier.add_user_to_account_tier(tier=self.tier_class, user=self.user)
+
+    def tearDown(self):
+        shutdown_pool()
+
+    def test_create_thumbnails_in_parallel(self):
+        file = create_image((1500, 1000))
+        image = Image.create_image(self.user, File(file, name='uploaded_file.jpg'))
+        thumbnails = Thumbnail.create_thumbnails(image, self.thumbnails, File(file, name='uploaded_file.jpg'))
+        self.assertEqual([thumbnail.thumbnail_size.height for thumbnail in thumbnails], [400, 200, 100])
+        for thumbnail in thumbnails:
+            with PILImage.open('media/' + thumbnail.url.name) as stored:
+                self.assertEqual(stored.format, 'JPEG')
+                self.assertEqual(stored.size, (thumbnail.thumbnail_size.height * 3 // 2,
+                                               thumbnail.thumbnail_size.height))
+            os.remove('media/' + thumbnail.url.name)
+
+    def test_render_palette_image_in_parallel(self):
+        img = PILImage.new('RGB', (600, 600), color='blue').convert('P')
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='png')
+        image = Image(name='palette.png', owner=self.user)
+        photos = Thumbnail._create_pending(image, self.thumbnails[:2], save=False)
+        rendered = render_thumbnails(img_bytes, photos)
+        with PILImage.open(rendered[0][0]) as stored:
+            self.assertEqual(stored.size, (200, 200))
+            self.assertEqual(stored.convert('RGB').getpixel((0, 0)), (0, 0, 255))
+
+    @override_settings(THUMBNAIL_RENDITION_FORMATS=['webp', 'unknown'])
+    def test_render_renditions_in_parallel(self):
+        image = Image(name='photo.jpg', owner=self.user)
+        photos = Thumbnail._create_pending(image, self.thumbnails[:2], save=False)
+        rendered = render_thumbnails(create_image((600, 600)), photos)
+        self.assertEqual([list(renditions) for _, renditions in rendered], [['webp'], ['webp']])
+        with PILImage.open(rendered[0][1]['webp']) as stored:
+            self.assertEqual(stored.format, 'WEBP')
+            self.assertEqual(stored.size, (200, 200))
+
+    def test_render_shares_pixels_with_workers(self):
+        pool = get_pool()
+        submitted = []
+
+        def submit(function, *args):
+            submitted.append(args)
+            return pool.submit(function, *args)
+
+        image = Image(name='photo.jpg', owner=self.user)
+        photos = Thumbnail._create_pending(image, self.thumbnails, save=False)
+        with mock.patch('image_app.functions.get_pool', return_value=mock.Mock(submit=submit)):
+            rendered = render_thumbnails(create_image((600, 400)), photos)
+        self.assertEqual([PILImage.open(content).size for content, _ in rendered], [(600, 400), (300, 200), (150, 100)])
+        self.assertEqual(len(submitted), 3)
+        self.assertFalse(any(isinstance(arg, bytes) for args in submitted for arg in args))
+        self.assertEqual(len({args[2] for args in submitted}), 1)
+        self.assertRaises(FileNotFoundError, shared_memory.SharedMemory, name=submitted[0][2])
+
+    @override_settings(THUMBNAIL_MAX_DECODE_PIXELS=600 * 400, THUMBNAIL_POOL_SIZE=8)
+    def test_render_batch_bounds_decoded_bytes_in_flight(self):
+        submit, release = functions._submit_parallel, functions._release
+        alive = [0]
+
+        def counted_submit(*args):
+            submitted = submit(*args)
+            alive.append(alive[-1] + 1)
+            return submitted
+
+        def counted_release(buffer):
+            release(buffer)
+            alive.append(alive[-1] - 1)
+
+        uploads = [(create_image((600, 400)), Thumbnail._create_pending(
+            Image(name='photo%d.jpg' % index, owner=self.user), self.thumbnails, save=False)) for index in range(5)]
+        with mock.patch.object(functions, '_submit_parallel', counted_submit), \
+                mock.patch.object(functions, '_release', counted_release):
+            rendered = render_batch(uploads)
+        self.assertEqual([len(sizes) for sizes in rendered], [3] * 5)
+        self.assertEqual(max(alive), 2)
+        self.assertEqual(alive[-1], 0)
+
+    def test_resize_buffer_passes_read_only_bytes(self):
+        source = PILImage.new('RGB', (300, 200), color='red')
+        pixels = source.tobytes()
+        buffer = shared_memory.SharedMemory(create=True, size=len(pixels))
+        buffer.buf[:] = pixels
+        frombytes = PILImage.frombytes
+
+        def read_only_frombytes(mode, size, data, *args):
+            if not isinstance(data, bytes):
+                raise TypeError('argument 1 must be read-only bytes-like object')
+            return frombytes(mode, size, data, *args)
+
+        try:
+            with mock.patch('image_app.functions.Image.frombytes', read_only_frombytes):
+                content, = resize_buffer('RGB', (300, 200), buffer.name, 100, ['JPEG'], [{}])
+        finally:
+            buffer.close()
+            buffer.unlink()
+        with PILImage.open(io.BytesIO(content)) as stored:
+            self.assertEqual(stored.size, (150, 100))
+
+    def test_render_not_thumbnail(self):
+        self.assertRaises(TypeError, render_thumbnails, create_image((100, 100)), ['thumbnail'])
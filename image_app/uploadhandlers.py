@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+import hashlib
+import os
+
+
+def staged_file(name, content_type=None):
+    os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+    return TemporaryUploadedFile(name, content_type, 0, None)
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+        super().new_file(*args, **kwargs)
+        self.hash = hashlib.blake2b(digest_size=32)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.content_hash = self.hash.hexdigest()
+        return file
@@ -1,14 +1,19 @@
 from django.urls import path
-from .views import UploadViewSet, ImagesWithDetailsViewSet, GenerateExpiringLink, GetImage, ImagesViewSet, Login, Navigation
+from .views import UploadViewSet, BulkUploadViewSet, ImagesWithDetailsViewSet, GenerateExpiringLink, GetImage, \
+    ImagesViewSet, Login, Navigation, LazyThumbnail, ThumbnailSrcset
 
 
 urlpatterns = [
     path('', Navigation.as_view()),
     path('link/', GenerateExpiringLink.as_view({'post': 'create'})),
+    path('link/bulk/', GenerateExpiringLink.as_view({'post': 'create_batch'})),
     path('upload/', UploadViewSet.as_view({'post': 'create'})),
+    path('upload/bulk/', BulkUploadViewSet.as_view({'post': 'create'})),
     path('images/', ImagesViewSet.as_view({'get': 'list'})),
     path('images/details/', ImagesWithDetailsViewSet.as_view({'get': 'list'})),
     path('images/details/<str:image_name>', ImagesWithDetailsViewSet.as_view({'get': 'get_one'})),
-    path('link/<str:expiring_name>', GetImage.as_view()),
+    path('images/<str:image_name>/thumbnails/', ThumbnailSrcset.as_view()),
+    path('images/<str:image_name>/thumbnails/<int:height>', LazyThumbnail.as_view()),
+    path('link/<str:expiring_name>', GetImage.as_view(), name='expiring-link'),
     path('login/', Login.as_view({'post': 'post'}))
 ]
@@ -1,14 +1,49 @@
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth import authenticate, login
-from django.http.response import HttpResponse
+from django.db.models import Prefetch
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.http.response import HttpResponseNotModified
 from rest_framework.viewsets import ViewSet, ReadOnlyModelViewSet
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
 from .serializers import *
-from .models import Image, AccountTier, Thumbnail, ExpiringLink
+from .pagination import ImageCursorPagination
+from .responses import file_response, accepted_formats, is_not_modified, set_validators, ImageNegotiation
+from .cache import listing_cache
+from .storage import atomic_upload
+from .functions import sniff_image, fits_decode_budget, ImageTooLarge, InvalidImage, IMAGE_FORMATS
+from .models import Image, AccountTier, Thumbnail, ThumbnailJob, ExpiringLink
+
+
+UPLOAD_ERRORS = (
+    (ImageTooLarge, 'Image is too large', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE),
+    (InvalidImage, 'File is corrupt or does not match its media type and extension',
+     status.HTTP_422_UNPROCESSABLE_ENTITY),
+    (ValueError, 'Not supported file extension. Supported extensions: .jpg, .png', status.HTTP_422_UNPROCESSABLE_ENTITY)
+)
+UNSUPPORTED_MEDIA_TYPE = 'Unsupported media type. Valid media types: "image/jpeg", "image/png"'
+
+
+def check_upload(file, account_tier):
+    if file.name[-4:] not in ['.jpg', '.png']:
+        raise ValueError
+    image_format, (width, height) = sniff_image(file)
+    if IMAGE_FORMATS[image_format] != (file.content_type, file.name[-4:]):
+        raise InvalidImage
+    if width * height > account_tier.max_pixels or not fits_decode_budget(image_format, width, height):
+        raise ImageTooLarge
+
+
+def upload_error(error):
+    for error_type, message, error_status in UPLOAD_ERRORS:
+        if isinstance(error, error_type):
+            return message, error_status
 
 
 class UploadViewSet(LoginRequiredMixin, ViewSet):
@@ -20,41 +55,125 @@ class UploadViewSet(LoginRequiredMixin, ViewSet):
             return Response({'message': 'Image not send'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         elif file_uploaded.content_type == 'image/jpeg' or file_uploaded.content_type == 'image/png':
             try:
-                account_tier = AccountTier.objects.get(user=request.user).tier
-                img = Image.create_image(owner=request.user, file=file_uploaded)
-                thumbnail_sizes = account_tier.thumbnail_sizes.order_by('-height')
-                for thumbnail_size in thumbnail_sizes:
-                    file_uploaded, thumbnail = Thumbnail.create_thumbnail(image=img, thumbnail_size=thumbnail_size,
-                                                                          file=file_uploaded)
+                account_tier = AccountTier.get_capabilities(request.user)
+                check_upload(file_uploaded, account_tier)
+                with atomic_upload():
+                    img = Image.create_image(owner=request.user, file=file_uploaded)
+                    thumbnail_sizes = list(account_tier.thumbnail_sizes)
+                    if settings.THUMBNAIL_ASYNC:
+                        ThumbnailJob.enqueue(image=img, thumbnail_sizes=thumbnail_sizes, file=file_uploaded)
+                    else:
+                        Thumbnail.create_thumbnails(image=img, thumbnail_sizes=thumbnail_sizes, file=file_uploaded)
                 image = ImageWithThumbnailsSerializer(img, context={'request': request})
                 return Response(image.data, status=status.HTTP_201_CREATED)
             except AccountTier.DoesNotExist:
                 return Response({'message': 'Not allowed to upload images'}, status=status.HTTP_403_FORBIDDEN)
-            except ValueError:
-                return Response({'message': 'Not supported file extension. Supported extensions: .jpg, .png'},
-                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-        return Response({'message': 'Unsupported media type. Valid media types: "image/jpeg", "image/png"'},
-                        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+            except ValueError as error:
+                message, error_status = upload_error(error)
+                return Response({'message': message}, status=error_status)
+            finally:
+                file_uploaded.close()
+        return Response({'message': UNSUPPORTED_MEDIA_TYPE}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+class BulkUploadViewSet(LoginRequiredMixin, ViewSet):
+    serializer_class = BulkUploadSerializer
+
+    def create(self, request):
+        files = request.FILES.getlist('files')
+        try:
+            if not files:
+                return Response({'message': 'Images not send'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if len(files) > settings.BULK_UPLOAD_MAX_FILES:
+                return Response({'message': 'Too many files. Maximum files per request: %d'
+                                            % settings.BULK_UPLOAD_MAX_FILES},
+                                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            account_tier = AccountTier.get_capabilities(request.user)
+            results, accepted = [], []
+            for file in files:
+                results.append({'file': file.name})
+                if file.content_type not in ['image/jpeg', 'image/png']:
+                    results[-1].update(status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, message=UNSUPPORTED_MEDIA_TYPE)
+                    continue
+                try:
+                    check_upload(file, account_tier)
+                    accepted.append((results[-1], file))
+                except ValueError as error:
+                    message, error_status = upload_error(error)
+                    results[-1].update(status=error_status, message=message)
+            if accepted:
+                self.create_images(request, account_tier, accepted)
+            if [result for result in results if result['status'] != status.HTTP_201_CREATED]:
+                return Response({'results': results}, status=status.HTTP_207_MULTI_STATUS)
+            return Response({'results': results}, status=status.HTTP_201_CREATED)
+        except AccountTier.DoesNotExist:
+            return Response({'message': 'Not allowed to upload images'}, status=status.HTTP_403_FORBIDDEN)
+        finally:
+            for file in files:
+                file.close()
+
+    def create_images(self, request, account_tier, accepted):
+        thumbnail_sizes = list(account_tier.thumbnail_sizes)
+        with atomic_upload():
+            images = Image.create_images(request.user, [file for _, file in accepted])
+            uploads = [(image, file) for image, (_, file) in zip(images, accepted)]
+            if settings.THUMBNAIL_ASYNC:
+                for image, file in uploads:
+                    ThumbnailJob.enqueue(image=image, thumbnail_sizes=thumbnail_sizes, file=file)
+            else:
+                created = Thumbnail.create_thumbnails_batch(uploads, thumbnail_sizes, return_exceptions=True)
+                for (result, _), image, thumbnails in zip(accepted, images, created):
+                    if isinstance(thumbnails, Exception):
+                        message, error_status = upload_error(InvalidImage())
+                        result.update(status=error_status, message=message)
+                        image.delete()
+        details = ImagesWithDetailsViewSet.queryset.in_bulk([image.pk for image in images if image.pk is not None])
+        for (result, _), image in zip(accepted, images):
+            if image.pk is not None:
+                result.update(status=status.HTTP_201_CREATED, image=ImageWithThumbnailsSerializer(
+                    details[image.pk], context={'request': request}).data)
+
 
+class CachedListMixin:
+    def list(self, request, *args, **kwargs):
+        key = listing_cache.key(request)
+        data = listing_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            patch_vary_headers(response, ['Accept'])
+            return response
+        response = super(CachedListMixin, self).list(request, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+        listing_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
 
-class ImagesViewSet(LoginRequiredMixin, ReadOnlyModelViewSet):
+
+class ImagesViewSet(LoginRequiredMixin, CachedListMixin, ReadOnlyModelViewSet):
     serializer_class = ImageSerializer
     queryset = Image.objects.all().order_by('-pk')
+    pagination_class = ImageCursorPagination
+
+    def get_queryset(self):
+        return self.queryset.filter(owner=self.request.user)
 
     def get(self, request):
-        images = self.queryset.filter(owner=self.request.user)
-        serializer = ImageSerializer(images, many=True, context={'request': request})
-        return Response(serializer.data)
+        return self.list(request)
 
 
-class ImagesWithDetailsViewSet(LoginRequiredMixin, ReadOnlyModelViewSet):
+class ImagesWithDetailsViewSet(LoginRequiredMixin, CachedListMixin, ReadOnlyModelViewSet):
     serializer_class = ImageWithThumbnailsSerializer
-    queryset = Image.objects.all().order_by('-pk')
+    queryset = Image.objects.prefetch_related(
+        Prefetch('thumbnail_set', queryset=Thumbnail.objects.select_related('thumbnail_size').order_by('pk'))
+    ).order_by('-pk')
+    pagination_class = ImageCursorPagination
+
+    def get_queryset(self):
+        return self.queryset.filter(owner=self.request.user)
 
     def get(self, request):
-        images = self.queryset.filter(owner=request.user)
-        serializer = self.get_serializer(images, context={'request': request}, many=True)
-        return Response(serializer.data)
+        return self.list(request)
 
     @action(detail=False)
     def get_one(self, request, image_name):
@@ -73,12 +192,16 @@ class GenerateExpiringLink(LoginRequiredMixin, ViewSet):
 
     def create(self, request):
         try:
-            if AccountTier.objects.get(user=request.user).tier.expiring_link:
+            if AccountTier.get_capabilities(request.user).expiring_link:
                 image = Image.objects.get(owner=request.user, name=request.data['image_name'])
                 if image.url.name == '':
                     return Response({'message': 'Image not valid to generate expiring link'},
                                     status=status.HTTP_409_CONFLICT)
-                link = ExpiringLink.generate(image, int(request.data['seconds']))
+                signed = request.data.get('signed', settings.SIGNED_EXPIRING_LINKS)
+                if BooleanField().to_internal_value(signed):
+                    link = ExpiringLink.generate_signed(image, int(request.data['seconds']))
+                else:
+                    link = ExpiringLink.generate(image, int(request.data['seconds']))
                 link = ExpiringLinkSerializer(link, context={'request': request})
                 return Response(link.data)
             else:
@@ -87,22 +210,117 @@ class GenerateExpiringLink(LoginRequiredMixin, ViewSet):
             return Response({'message': 'Not allowed to generate expiring link'}, status=status.HTTP_403_FORBIDDEN)
         except Image.DoesNotExist:
             return Response({'message': 'Image does not exists'}, status=status.HTTP_404_NOT_FOUND)
-        except ValueError:
+        except (ValueError, ValidationError):
             return Response({'message': 'Not valid arguments'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         except TypeError:
             return Response({'message': 'Not valid type of arguments'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
+    def create_batch(self, request):
+        try:
+            if not AccountTier.get_capabilities(request.user).expiring_link:
+                return Response({'message': 'Not allowed to generate expiring link'}, status=status.HTTP_403_FORBIDDEN)
+            requested = request.data['links']
+            if not isinstance(requested, list) or len(requested) > settings.EXPIRING_LINK_BATCH_MAX:
+                raise ValueError
+            signed = BooleanField().to_internal_value(request.data.get('signed', settings.SIGNED_EXPIRING_LINKS))
+        except AccountTier.DoesNotExist:
+            return Response({'message': 'Not allowed to generate expiring link'}, status=status.HTTP_403_FORBIDDEN)
+        except (KeyError, TypeError, ValueError, ValidationError):
+            return Response({'message': 'Not valid arguments'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        results, parsed = [], []
+        for link in requested:
+            try:
+                name, seconds = link['image_name'], int(link['seconds'])
+                if not isinstance(name, str) or not ExpiringLink.MIN_SECONDS <= seconds <= ExpiringLink.MAX_SECONDS:
+                    raise ValueError
+                results.append({'image_name': name})
+                parsed.append((results[-1], name, seconds))
+            except (KeyError, TypeError, ValueError):
+                results.append({'image_name': link.get('image_name') if isinstance(link, dict) else None,
+                                'status': status.HTTP_422_UNPROCESSABLE_ENTITY, 'message': 'Not valid arguments'})
+        images = Image.objects.filter(owner=request.user).in_bulk({name for _, name, _ in parsed}, field_name='name')
+        pending = []
+        for result, name, seconds in parsed:
+            if name not in images:
+                result.update(status=status.HTTP_404_NOT_FOUND, message='Image does not exists')
+            elif images[name].url.name == '':
+                result.update(status=status.HTTP_409_CONFLICT, message='Image not valid to generate expiring link')
+            else:
+                pending.append((result, images[name], seconds))
+        links = ExpiringLink.generate_batch([(image, seconds) for _, image, seconds in pending], signed)
+        serialized = ExpiringLinkSerializer(links, many=True, context={'request': request}).data
+        for (result, _, _), link in zip(pending, serialized):
+            result.update(status=status.HTTP_200_OK, **link)
+        if len(pending) < len(results):
+            return Response({'links': results}, status=status.HTTP_207_MULTI_STATUS)
+        return Response({'links': results})
+
+
+class LazyThumbnail(LoginRequiredMixin, APIView):
+    content_negotiation_class = ImageNegotiation
+
+    def get(self, request, image_name, height):
+        try:
+            image = Image.objects.get(owner=request.user, name=image_name)
+            capabilities = AccountTier.get_capabilities(request.user)
+            sizes = [size for size in capabilities.thumbnail_sizes if size.height == height]
+            if not sizes:
+                return Response({'message': 'Thumbnail size not available'}, status=status.HTTP_404_NOT_FOUND)
+            thumbnail = Thumbnail.get_or_render(image, sizes[0])
+        except (AccountTier.DoesNotExist, Image.DoesNotExist):
+            return Response({'message': 'Image does not exists'}, status=status.HTTP_404_NOT_FOUND)
+        except FileNotFoundError:
+            return Response({'message': 'No source to render thumbnail from'}, status=status.HTTP_409_CONFLICT)
+        except (OSError, SyntaxError, ValueError):
+            return Response({'message': 'Thumbnail could not be rendered'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if thumbnail.status == Thumbnail.Status.PENDING:
+            thumbnail = ThumbnailSerialzer(thumbnail, context={'request': request})
+            return Response(thumbnail.data, status=status.HTTP_202_ACCEPTED)
+        requested = request.query_params.get('rendition')
+        field_file, content_type = thumbnail.rendition([requested] if requested else accepted_formats(request))
+        etag = thumbnail.etag(content_type)
+        last_modified = thumbnail.rendered_at.timestamp() if thumbnail.rendered_at else None
+        if is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            try:
+                response = file_response(request, field_file, content_type)
+            except FileNotFoundError:
+                return Response({'message': 'Resource not found'}, status=status.HTTP_404_NOT_FOUND)
+        patch_vary_headers(response, ['Accept'])
+        immutable = etag is not None and request.query_params.get('v') == thumbnail.version
+        return set_validators(response, etag, last_modified, immutable)
+
+
+class ThumbnailSrcset(LoginRequiredMixin, APIView):
+    def get(self, request, image_name):
+        try:
+            image = Image.objects.get(owner=request.user, name=image_name)
+        except Image.DoesNotExist:
+            return Response({'message': 'Image does not exists'}, status=status.HTTP_404_NOT_FOUND)
+        srcset = {}
+        thumbnails = image.thumbnail_set.filter(status=Thumbnail.Status.READY, width__isnull=False)
+        for thumbnail in thumbnails.select_related('thumbnail_size').order_by('thumbnail_size__height'):
+            for _, content_type in thumbnail.renditions():
+                url = request.build_absolute_uri('/images/%s/thumbnails/%d?rendition=%s&v=%s' % (
+                    image.name, thumbnail.thumbnail_size.height, content_type[len('image/'):], thumbnail.version))
+                srcset.setdefault(content_type, []).append('%s %dw' % (url, thumbnail.width))
+        return Response({'name': image.name,
+                         'srcset': {content_type: ', '.join(urls) for content_type, urls in srcset.items()}})
+
 
 class GetImage(APIView):
     def get(self, request, expiring_name):
         try:
-            link = ExpiringLink.objects.get(name=expiring_name, expiring_time__gte=timezone.now())
+            if ExpiringLink.is_signed(expiring_name):
+                link = ExpiringLink.from_signed(expiring_name)
+            else:
+                link = ExpiringLink.objects.get(name=expiring_name, expiring_time__gte=timezone.now())
             if link.image.name.endswith('.jpg'):
-                with link.image.url as file:
-                    return HttpResponse(file.read(), content_type='image/jpeg')
+                return file_response(request, link.image.url, 'image/jpeg')
             elif link.image.name.endswith('.png'):
-                with link.image.url as file:
-                    return HttpResponse(file.read(), content_type='image/png')
+                return file_response(request, link.image.url, 'image/png')
             else:
                 return Response({'message': 'Unsupported media type'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except (ExpiringLink.DoesNotExist, FileNotFoundError):
@@ -127,5 +345,7 @@ class Navigation(APIView):
             'images': request.build_absolute_uri('images/'),
             'images details': request.build_absolute_uri('images/details/'),
             'upload_image': request.build_absolute_uri('upload/'),
-            'generate expiring link': request.build_absolute_uri('link/')
+            'bulk upload': request.build_absolute_uri('upload/bulk/'),
+            'generate expiring link': request.build_absolute_uri('link/'),
+            'generate expiring links': request.build_absolute_uri('link/bulk/')
         }}, status=status.HTTP_200_OK)
\ No newline at end of file
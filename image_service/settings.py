@@ -79,10 +79,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+# 'listings' keeps rendered /images/ and /images/details/ pages. Use a shared
+# backend (e.g. FileBasedCache) when more than one process serves or changes
+# images, so every process sees the same invalidations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'listings': {
+        'BACKEND': os.environ.get('LISTING_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('LISTING_CACHE_LOCATION', 'listings'),
+        'TIMEOUT': 300,
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -117,6 +139,14 @@ USE_TZ = True
 
 LOGIN_URL = '/login'
 
+IMAGES_PAGE_SIZE = 50
+
+# Per-process cache of account tier capabilities. Other processes see tier
+# changes after at most TIER_CACHE_TTL seconds.
+TIER_CACHE_SIZE = 10000
+
+TIER_CACHE_TTL = 60
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
@@ -127,3 +157,75 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+# Uploads and rendered thumbnails are spooled to disk next to MEDIA_ROOT, so
+# storage moves them into place with a rename instead of copying them.
+FILE_UPLOAD_HANDLERS = ['image_app.uploadhandlers.HashingFileUploadHandler']
+
+FILE_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, 'tmp')
+
+# Internal nginx location that serves MEDIA_ROOT. When set, expiring links
+# answer with an X-Accel-Redirect header and nginx sends the file.
+MEDIA_ACCEL_REDIRECT_URL = os.environ.get('MEDIA_ACCEL_REDIRECT_URL')
+
+# Default for new expiring links: HMAC-signed tokens verified against
+# SECRET_KEY instead of ExpiringLink rows. Clients can override with 'signed'.
+SIGNED_EXPIRING_LINKS = False
+
+# Thumbnails
+
+# 'draft' lets the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+# when the largest requested thumbnail is far below the source height.
+# 'full' always decodes the source at native resolution.
+THUMBNAIL_DECODE_STRATEGY = 'draft'
+
+# Filter used to scale thumbnails: 'nearest', 'box', 'bilinear', 'hamming',
+# 'bicubic' or 'lanczos'. With a reducing gap, large downscales first shrink
+# by an integer factor with Image.reduce and only resample the last step;
+# None always resamples from the full decoded source.
+THUMBNAIL_RESAMPLING = 'bicubic'
+THUMBNAIL_REDUCING_GAP = 3.0
+
+# Lifetime of versioned thumbnail URLs (the ones carrying ?v=<content hash>).
+# Unversioned requests must revalidate with their ETag instead.
+THUMBNAIL_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Extra encodings ('webp', 'avif') stored next to every thumbnail and served to
+# clients whose Accept header lists them. Formats Pillow cannot write are skipped.
+THUMBNAIL_RENDITION_FORMATS = [format for format in os.environ.get('THUMBNAIL_RENDITION_FORMATS', '').split(',')
+                               if format]
+
+# Hard bound on pixels decoded into memory at once. Larger JPEGs are decoded
+# at a reduced scale to fit, other formats are rejected. The accepted source
+# size per account tier is AccountTierClass.max_pixels.
+THUMBNAIL_MAX_DECODE_PIXELS = 40000000
+
+# Render thumbnails in run_thumbnail_workers processes instead of inside the
+# upload request. Jobs are stored in the database, no broker is needed.
+THUMBNAIL_ASYNC = False
+
+THUMBNAIL_WORKERS = 2
+
+THUMBNAIL_JOB_MAX_ATTEMPTS = 3
+
+# Running jobs older than this many seconds are requeued when workers start.
+THUMBNAIL_JOB_TIMEOUT = 600
+
+# Resize and encode the sizes of one upload in parallel on a process pool
+# that is shared by all requests handled by this process.
+THUMBNAIL_PARALLEL = False
+
+THUMBNAIL_POOL_SIZE = os.cpu_count()
+
+# Files accepted by one bulk upload request, bounds the request's transaction.
+BULK_UPLOAD_MAX_FILES = 100
+
+# Links generated by one bulk expiring link request.
+EXPIRING_LINK_BATCH_MAX = 50000
+
+# Seconds a lazy thumbnail request waits for a render started elsewhere.
+LAZY_THUMBNAIL_TIMEOUT = 10
+
+# Pending thumbnails claimed longer ago than this many seconds are assumed to
+# be abandoned by a crashed render and are claimed again by the next request.
+THUMBNAIL_RENDER_TIMEOUT = 120